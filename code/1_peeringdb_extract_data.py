@@ -1,20 +1,25 @@
 import requests
-import csv
 from dotenv import load_dotenv
 from typing import List, Dict
 import os
+import sys
 import time
-from requests.exceptions import HTTPError
 import pandas as pd
 import json
+from http_client import http_get
+from storage import read_table, table_exists, write_table
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
 secret_key = os.getenv('SECRET_KEY')
 
-MAX_RETRIES = 3
 INITIAL_BACKOFF = 10  # seconds
 MAX_IDS_PER_REQUEST = 100
+PAGE_LIMIT = 250
+CONCURRENT_PAGINATION = True
+MAX_CONCURRENT_PAGES = 4  # Janela de offsets 'skip' em voo simultaneamente
 
 API_BASE_URL = "https://www.peeringdb.com/api"
 HEADERS = {
@@ -23,6 +28,10 @@ HEADERS = {
 }
 
 CONFIG_FILE = ".checkpoint.json"
+SYNC_STATE_FILE = os.path.join(os.path.dirname(CONFIG_FILE), ".sync_state.json")
+INCREMENTAL_SYNC = True  # Após uma extração completa, busca apenas os deltas via 'since'
+
+SYNC_TABLES = ["ix_data", "ixlan_data", "netixlan_data", "fac_data", "ixfac_data", "net_data", "poc_data"]
 
 def load_checkpoint():
     if os.path.exists(CONFIG_FILE) and os.path.getsize(CONFIG_FILE) > 0:
@@ -41,123 +50,237 @@ def save_checkpoint(step, progress):
     with open(CONFIG_FILE, 'w') as f:
         json.dump(checkpoint, f)
 
+def load_sync_state() -> Dict:
+    if os.path.exists(SYNC_STATE_FILE) and os.path.getsize(SYNC_STATE_FILE) > 0:
+        with open(SYNC_STATE_FILE, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                print("Error decoding sync state file. Falling back to a full sync.")
+    return {}
+
+def save_sync_state(state: Dict):
+    with open(SYNC_STATE_FILE, 'w') as f:
+        json.dump(state, f)
+
+def mark_synced(state: Dict, filename: str, timestamp: int):
+    state[filename] = timestamp
+    save_sync_state(state)
+
+def can_sync_incrementally(state: Dict, current_step: int) -> bool:
+    if not INCREMENTAL_SYNC or current_step <= 7:
+        return False
+    return all(table in state and table_exists(f"peeringdb_{table}") for table in SYNC_TABLES)
+
 def fetch_with_retry(url: str, params: Dict) -> requests.Response:
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.get(url, headers=HEADERS, params=params)
-            response.raise_for_status()
-            return response
-        except HTTPError as e:
-            if e.response.status_code == 429 and attempt < MAX_RETRIES - 1:
-                wait_time = INITIAL_BACKOFF * (2 ** attempt)
-                print(f"Rate limit reached. Waiting {wait_time} seconds before trying again...")
-                time.sleep(wait_time)
-            else:
-                raise
+    # Retry e backoff em 429 (compartilhado entre as threads) ficam no cliente HTTP comum
+    return http_get(url, retry_delay=INITIAL_BACKOFF, timeout=None, headers=HEADERS, params=params)
 
-def fetch_data(endpoint: str, params: Dict) -> List[Dict]:
-    print(f"Fetching data from {endpoint} with params: {params}")
+def fetch_page(endpoint: str, params: Dict, skip: int) -> List[Dict]:
+    page_params = dict(params, depth=1, limit=PAGE_LIMIT, skip=skip)
+    response = fetch_with_retry(f"{API_BASE_URL}{endpoint}", page_params)
+    return response.json()["data"]
+
+def fetch_data_sequential(endpoint: str, params: Dict) -> List[Dict]:
     all_data = []
     skip = 0
     while True:
-        params["depth"] = 1
-        params["limit"] = 250
-        params["skip"] = skip
-        response = fetch_with_retry(f"{API_BASE_URL}{endpoint}", params)
-        data = response.json()["data"]
-        if not data:
-            break
+        data = fetch_page(endpoint, params, skip)
         all_data.extend(data)
-        skip += 250
+        skip += PAGE_LIMIT
         print(f"Pagination: {skip}")
+        if len(data) < PAGE_LIMIT:
+            break
     return all_data
 
-def fetch_data_in_batches(endpoint: str, id_param: str, ids: List[int]) -> List[Dict]:
+def fetch_data_concurrent(endpoint: str, params: Dict) -> List[Dict]:
+    # A primeira página vai sozinha: a maioria das consultas (lotes de ids, deltas 'since') cabe
+    # numa página, e só quando ela volta cheia a janela de offsets é aberta
+    all_data = fetch_page(endpoint, params, 0)
+    print(f"Pagination: {len(all_data)}")
+    if len(all_data) < PAGE_LIMIT:
+        return all_data
+
+    next_skip = PAGE_LIMIT
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PAGES) as executor:
+        in_flight = deque()
+        for _ in range(MAX_CONCURRENT_PAGES):
+            in_flight.append(executor.submit(fetch_page, endpoint, params, next_skip))
+            next_skip += PAGE_LIMIT
+
+        # Consome as páginas na ordem dos offsets para manter os resultados ordenados
+        while in_flight:
+            data = in_flight.popleft().result()
+            all_data.extend(data)
+            print(f"Pagination: {len(all_data)}")
+            if len(data) < PAGE_LIMIT:
+                for future in in_flight:
+                    future.cancel()
+                break
+            in_flight.append(executor.submit(fetch_page, endpoint, params, next_skip))
+            next_skip += PAGE_LIMIT
+    return all_data
+
+def fetch_data(endpoint: str, params: Dict) -> List[Dict]:
+    print(f"Fetching data from {endpoint} with params: {params}")
+    if CONCURRENT_PAGINATION:
+        return fetch_data_concurrent(endpoint, params)
+    return fetch_data_sequential(endpoint, params)
+
+def fetch_data_in_batches(endpoint: str, id_param: str, ids: List[int], extra_params: Dict = None) -> List[Dict]:
     all_data = []
     for i in range(0, len(ids), MAX_IDS_PER_REQUEST):
         batch_ids = ids[i:i + MAX_IDS_PER_REQUEST]
         params = {id_param: ",".join(map(str, batch_ids))}
+        if extra_params:
+            params.update(extra_params)
         all_data.extend(fetch_data(endpoint, params))
     return all_data
 
-def save_csv(data: List[Dict], filename: str):
-    print(f"Saving data to CSV file: {filename}")
+def save_table(data: List[Dict], filename: str):
+    print(f"Saving data to table: {filename}")
     if not data:
         print(f"No data to save for {filename}")
         return
-    os.makedirs("output", exist_ok=True)
-    with open(f"output/peeringdb_{filename}.csv", 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=data[0].keys())
-        writer.writeheader()
-        writer.writerows(data)
+    write_table(data, f"peeringdb_{filename}")
 
-def build_unified_table():
-    print("Building unified table...")
-    ix_df = pd.read_csv("output/peeringdb_ix_data.csv")
-    ixlan_df = pd.read_csv("output/peeringdb_ixlan_data.csv")
-    netixlan_df = pd.read_csv("output/peeringdb_netixlan_data.csv")
-    fac_df = pd.read_csv("output/peeringdb_fac_data.csv")
-    ixfac_df = pd.read_csv("output/peeringdb_ixfac_data.csv")
-    net_df = pd.read_csv("output/peeringdb_net_data.csv")
-
-    # Selecionar colunas relevantes
-    ix_df = ix_df[['id', 'name', 'city', 'country', 'org_id']]
-    ixlan_df = ixlan_df[['id', 'ix_id', 'name']]
-    netixlan_df = netixlan_df[['id', 'net_id', 'ix_id', 'ixlan_id', 'asn', 'ipaddr4', 'ipaddr6', 'speed']]
-    fac_df = fac_df[['id', 'name', 'city', 'country', 'org_id']]
-    ixfac_df = ixfac_df[['id', 'ix_id', 'fac_id']]
-    net_df = net_df[['id', 'name', 'asn', 'info_type', 'policy_general']]
-
-    # Mesclar dataframes com left joins para manter todos os registros
-    merged_df = ix_df.merge(ixlan_df, left_on='id', right_on='ix_id', how='left', suffixes=('', '_ixlan'))
-    merged_df = merged_df.merge(netixlan_df, left_on='id', right_on='ix_id', how='left', suffixes=('', '_netixlan'))
-    merged_df = merged_df.merge(ixfac_df, left_on='id', right_on='ix_id', how='left', suffixes=('', '_ixfac'))
-    merged_df = merged_df.merge(fac_df, left_on='fac_id', right_on='id', how='left', suffixes=('', '_fac'))
-    merged_df = merged_df.merge(net_df, left_on='net_id', right_on='id', how='left', suffixes=('', '_net'))
-
-    # Renomear colunas para evitar ambiguidades
-    column_mapping = {
-        'id': 'ix_id',
-        'id_ixlan': 'ixlan_id',
-        'id_netixlan': 'netixlan_id',
-        'id_ixfac': 'ixfac_id',
-        'id_fac': 'fac_id',
-        'id_net': 'net_id',
-        'name': 'ix_name',
-        'name_ixlan': 'ixlan_name',
-        'name_fac': 'fac_name',
-        'name_net': 'net_name',
-        'city': 'ix_city',
-        'city_fac': 'fac_city',
-        'country': 'ix_country',
-        'country_fac': 'fac_country',
-        'org_id': 'ix_org_id',
-        'org_id_fac': 'fac_org_id',
-        'asn': 'net_asn',
-        'asn_net': 'net_asn'
+def merge_delta(delta: List[Dict], filename: str) -> pd.DataFrame:
+    existing_df = read_table(f"peeringdb_{filename}")
+    print(f"Merging {len(delta)} changed records into {filename}")
+    if not delta:
+        return existing_df
+
+    delta_df = pd.DataFrame(delta).drop_duplicates('id', keep='last')
+    # Upserts substituem a versão anterior; registros com status 'deleted' são removidos
+    merged_df = existing_df[~existing_df['id'].isin(delta_df['id'])]
+    if 'status' in delta_df.columns:
+        delta_df = delta_df[delta_df['status'] != 'deleted']
+    merged_df = pd.concat([merged_df, delta_df], ignore_index=True).sort_values('id')
+    return write_table(merged_df, f"peeringdb_{filename}")
+
+def sync_table(state: Dict, filename: str, endpoint: str, params: Dict = None,
+               id_param: str = None, ids: List[int] = None) -> pd.DataFrame:
+    sync_started = int(time.time())
+    since = {"since": state[filename]}
+    if id_param:
+        delta = fetch_data_in_batches(endpoint, id_param, ids, since) if ids else []
+    else:
+        delta = fetch_data(endpoint, dict(params or {}, **since))
+    merged_df = merge_delta(delta, filename)
+    mark_synced(state, filename, sync_started)
+    return merged_df
+
+def backfill_missing(referenced_ids, known_df: pd.DataFrame, filename: str, endpoint: str, id_param: str) -> pd.DataFrame:
+    # Objetos antigos passam a ser referenciados (ex.: uma rede que entrou num IX) sem terem sido alterados
+    missing_ids = sorted(set(int(i) for i in referenced_ids if pd.notna(i)) - set(known_df['id']))
+    if not missing_ids:
+        return known_df
+    print(f"Backfilling {len(missing_ids)} records missing from {filename}")
+    return merge_delta(fetch_data_in_batches(endpoint, id_param, missing_ids), filename)
+
+def incremental_sync(state: Dict):
+    print("# Sincronização incremental (since)")
+    ix_df = sync_table(state, "ix_data", "/ix", params={"country": "BR"})
+    ix_ids = ix_df['id'].tolist()
+    ixlan_df = sync_table(state, "ixlan_data", "/ixlan", id_param="ix_id__in", ids=ix_ids)
+    netixlan_df = sync_table(state, "netixlan_data", "/netixlan", id_param="ixlan_id__in", ids=ixlan_df['id'].tolist())
+    fac_df = sync_table(state, "fac_data", "/fac", params={"country": "BR"})
+    fac_ids = fac_df['id'].tolist()
+    sync_table(state, "ixfac_data", "/ixfac", id_param="fac_id__in", ids=fac_ids)
+
+    # NETs vêm de duas consultas (por IX e por FAC) que compartilham o mesmo 'since'
+    net_started = int(time.time())
+    since = {"since": state["net_data"]}
+    net_delta = fetch_data_in_batches("/net", "ix_id__in", ix_ids, since)
+    net_delta.extend(fetch_data_in_batches("/net", "fac_id__in", fac_ids, since))
+    net_df = merge_delta(net_delta, "net_data")
+    mark_synced(state, "net_data", net_started)
+    known_net_ids = set(net_df['id'])
+    net_df = backfill_missing(netixlan_df['net_id'], net_df, "net_data", "/net", "id__in")
+    new_net_ids = sorted(set(net_df['id']) - known_net_ids)
+
+    sync_table(state, "poc_data", "/poc", id_param="net_id__in", ids=net_df['id'].tolist())
+    if new_net_ids:
+        merge_delta(fetch_data_in_batches("/poc", "net_id__in", new_net_ids), "poc_data")
+
+def aggregate_facilities(ixfac_df: pd.DataFrame, fac_df: pd.DataFrame) -> pd.DataFrame:
+    # Uma linha por IX com a lista de facilities, em vez de multiplicar cada membro por cada facility
+    ixfac_df = ixfac_df.merge(fac_df[['fac_id', 'fac_name']], on='fac_id', how='left').sort_values('fac_id')
+    grouped = ixfac_df.groupby('ix_id')
+    return pd.DataFrame({
+        'fac_count': grouped['fac_id'].nunique(),
+        'fac_ids': grouped['fac_id'].agg(lambda ids: ';'.join(str(i) for i in ids.dropna().unique())),
+        'fac_names': grouped['fac_name'].agg(lambda names: '; '.join(names.dropna().unique())),
+    }).reset_index()
+
+def build_star_schema() -> Dict[str, pd.DataFrame]:
+    # Fato: uma linha por participação de rede em IX (netixlan). Dimensões: IX, rede e facility.
+    # Cada tabela cresce linearmente com a sua entrada; nenhum join produz produto cartesiano
+    ix_df = read_table("peeringdb_ix_data", columns=['id', 'name', 'city', 'country', 'org_id'])
+    ixlan_df = read_table("peeringdb_ixlan_data", columns=['id', 'ix_id', 'name'])
+    netixlan_df = read_table("peeringdb_netixlan_data",
+                             columns=['id', 'net_id', 'ix_id', 'ixlan_id', 'asn', 'ipaddr4', 'ipaddr6', 'speed'])
+    fac_df = read_table("peeringdb_fac_data", columns=['id', 'name', 'city', 'country', 'org_id'])
+    ixfac_df = read_table("peeringdb_ixfac_data", columns=['id', 'ix_id', 'fac_id'])
+    net_df = read_table("peeringdb_net_data", columns=['id', 'name', 'asn', 'info_type', 'policy_general'])
+
+    dim_fac = fac_df.rename(columns={'id': 'fac_id', 'name': 'fac_name', 'city': 'fac_city',
+                                     'country': 'fac_country', 'org_id': 'fac_org_id'}).drop_duplicates('fac_id')
+    bridge_ixfac = ixfac_df.rename(columns={'id': 'ixfac_id'}).drop_duplicates('ixfac_id')
+    dim_ix = ix_df.rename(columns={'id': 'ix_id', 'name': 'ix_name', 'city': 'ix_city',
+                                   'country': 'ix_country', 'org_id': 'ix_org_id'}).drop_duplicates('ix_id')
+    dim_ix = dim_ix.merge(aggregate_facilities(bridge_ixfac, dim_fac), on='ix_id', how='left')
+    dim_ix['fac_count'] = dim_ix['fac_count'].fillna(0).astype('Int64')
+    # A rede pode ter vindo das consultas por IX e por FAC: uma linha por net_id
+    dim_net = net_df.rename(columns={'id': 'net_id', 'name': 'net_name', 'asn': 'net_asn'}).drop_duplicates('net_id')
+    fact_netixlan = netixlan_df.rename(columns={'id': 'netixlan_id'}).drop_duplicates('netixlan_id')
+    fact_netixlan = fact_netixlan.merge(
+        ixlan_df.rename(columns={'id': 'ixlan_id', 'name': 'ixlan_name'})[['ixlan_id', 'ixlan_name']].drop_duplicates('ixlan_id'),
+        on='ixlan_id', how='left')
+
+    return {
+        "peeringdb_dim_ix": dim_ix,
+        "peeringdb_dim_net": dim_net,
+        "peeringdb_dim_fac": dim_fac,
+        "peeringdb_bridge_ixfac": bridge_ixfac,
+        "peeringdb_fact_netixlan": fact_netixlan,
     }
-    merged_df = merged_df.rename(columns=column_mapping)
 
-    # Remover colunas duplicadas
-    merged_df = merged_df.loc[:, ~merged_df.columns.duplicated()]
+def build_unified_table():
+    print("Building unified table...")
+    tables = build_star_schema()
+    for name, df in tables.items():
+        write_table(df, name)
 
-    # Remover duplicatas de linhas
-    merged_df = merged_df.drop_duplicates()
+    # Visão desnormalizada: uma linha por netixlan (e uma por IX sem membros), com as facilities
+    # do IX já agregadas. O tamanho é #netixlan + #IX, não #netixlan × #ixfac
+    fact_df = tables["peeringdb_fact_netixlan"].rename(columns={'asn': 'netixlan_asn'})
+    merged_df = tables["peeringdb_dim_ix"].merge(fact_df, on='ix_id', how='left')
+    merged_df = merged_df.merge(tables["peeringdb_dim_net"], on='net_id', how='left')
+    # O ASN do netixlan vale quando a rede não foi baixada
+    merged_df['net_asn'] = merged_df['net_asn'].fillna(merged_df.pop('netixlan_asn'))
 
-    # Salvar tabela unificada
-    merged_df.to_csv("output/peeringdb_unified_data.csv", index=False)
-    print("Tabela unificada salva como 'output/peeringdb_unified_data.csv'")
+    write_table(merged_df, "peeringdb_unified_data")
+    print("Tabela unificada salva como 'peeringdb_unified_data'")
 
 def main():
     checkpoint = load_checkpoint()
     current_step = checkpoint["step"]
     progress = checkpoint["progress"]
+    sync_state = load_sync_state()
+    sync_started = int(time.time())
 
     try:
+        if can_sync_incrementally(sync_state, current_step):
+            incremental_sync(sync_state)
+            print("Incremental sync completed. Tables have been updated.")
+            return True
+
         if current_step <= 1:
             print("# 1. Consultar IXs do Brasil")
             ix_data = fetch_data("/ix", {"country": "BR"})
-            save_csv(ix_data, "ix_data")
+            save_table(ix_data, "ix_data")
+            mark_synced(sync_state, "ix_data", sync_started)
             progress["ix_ids"] = [ix["id"] for ix in ix_data]
             current_step = 2
             save_checkpoint(current_step, progress)
@@ -165,7 +288,8 @@ def main():
         if current_step <= 2:
             print("# 2. Consultar IXLANs associadas aos IXs do Brasil")
             ixlan_data = fetch_data_in_batches("/ixlan", "ix_id__in", progress["ix_ids"])
-            save_csv(ixlan_data, "ixlan_data")
+            save_table(ixlan_data, "ixlan_data")
+            mark_synced(sync_state, "ixlan_data", sync_started)
             progress["ixlan_ids"] = [ixlan["id"] for ixlan in ixlan_data]
             current_step = 3
             save_checkpoint(current_step, progress)
@@ -173,14 +297,16 @@ def main():
         if current_step <= 3:
             print("# 3. Consultar NETIXLANs associadas às IXLANs")
             netixlan_data = fetch_data_in_batches("/netixlan", "ixlan_id__in", progress["ixlan_ids"])
-            save_csv(netixlan_data, "netixlan_data")
+            save_table(netixlan_data, "netixlan_data")
+            mark_synced(sync_state, "netixlan_data", sync_started)
             current_step = 4
             save_checkpoint(current_step, progress)
 
         if current_step <= 4:
             print("# 4. Consultar FACs do Brasil")
             fac_data = fetch_data("/fac", {"country": "BR"})
-            save_csv(fac_data, "fac_data")
+            save_table(fac_data, "fac_data")
+            mark_synced(sync_state, "fac_data", sync_started)
             progress["fac_ids"] = [fac["id"] for fac in fac_data]
             current_step = 5
             save_checkpoint(current_step, progress)
@@ -188,7 +314,8 @@ def main():
         if current_step <= 5:
             print("# 5. Consultar IXFACs associados às FACs do Brasil")
             ixfac_data = fetch_data_in_batches("/ixfac", "fac_id__in", progress["fac_ids"])
-            save_csv(ixfac_data, "ixfac_data")
+            save_table(ixfac_data, "ixfac_data")
+            mark_synced(sync_state, "ixfac_data", sync_started)
             current_step = 6
             save_checkpoint(current_step, progress)
 
@@ -196,7 +323,8 @@ def main():
             print("# 6. Consultar NETs associadas aos IXs e FACs do Brasil")
             net_data = fetch_data_in_batches("/net", "ix_id__in", progress["ix_ids"])
             net_data.extend(fetch_data_in_batches("/net", "fac_id__in", progress["fac_ids"]))
-            save_csv(net_data, "net_data")
+            save_table(net_data, "net_data")
+            mark_synced(sync_state, "net_data", sync_started)
             progress["net_ids"] = list(set(net["id"] for net in net_data))
             current_step = 7
             save_checkpoint(current_step, progress)
@@ -204,23 +332,27 @@ def main():
         if current_step <= 7:
             print("# 7. Consultar POCs associados às NETs")
             poc_data = fetch_data_in_batches("/poc", "net_id__in", progress["net_ids"])
-            save_csv(poc_data, "poc_data")
+            save_table(poc_data, "poc_data")
+            mark_synced(sync_state, "poc_data", sync_started)
             current_step = 8
             save_checkpoint(current_step, progress)
 
         print("# 8. Construir tabela unificada")
         build_unified_table()
 
-        print("Data extraction and unification completed. CSV files have been saved.")
+        print("Data extraction and unification completed. Tables have been saved.")
+        return True
 
     except Exception as e:
         print(f"An error occurred during execution at step {current_step}: {str(e)}")
         import traceback
         traceback.print_exc()
+        # Código de saída diferente de zero para que o pipeline não marque a etapa como concluída
+        return False
     finally:
         # Sempre construir a tabela unificada, independentemente de erros anteriores
         print("# Construindo tabela unificada final")
         build_unified_table()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)
@@ -1,8 +1,14 @@
-import requests
-from bs4 import BeautifulSoup
+from http_client import http_get, pause_host, throttle_host, wait_for_host
+from storage import invalidate_parquet, write_table
+from city_pool import process_cities
+from html_parser import clean_html, parse, select_options
+from http_replay import replay_llm, replaying
+from extraction_scheduler import REQUESTS_PER_MINUTE, is_rate_limit_error
 import csv
+import html
 import os
-import time
+import pandas as pd
+import re
 import openai
 from dotenv import load_dotenv
 
@@ -12,37 +18,117 @@ load_dotenv()
 # Configura a chave da API OpenAI
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Se a chave da OpenAI estiver configurada, os blocos que as regras não resolvem vão para o GPT
+LLM_FALLBACK = os.getenv("LLM_FALLBACK", "1") == "1" and (bool(openai.api_key) or replaying())
+LLM_RETRIES = 3
+LLM_RETRY_DELAY = 5  # seconds, dobrando a cada 429
+LLM_HOST = "api.openai.com"  # Chave do limite por host de http_client para as chamadas ao modelo
+LLM_REQUESTS_PER_SECOND = REQUESTS_PER_MINUTE / 60  # O mesmo orçamento do extraction_scheduler
+
+COLUMNS = ['Sigla da Cidade', 'Nome da Cidade', 'UF do Estado', 'Nome curto Empresa', 'Nome longo Empresa', 'Nome do Responsável', 'E-mail', 'Domínio']
+
 def get_city_info(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    response = requests.get(url, headers=headers)
-    soup = BeautifulSoup(response.text, 'html.parser')
+    response = http_get(url)
+    options = select_options(response.text)
     
-    select = soup.find('select')
-    
-    if not select:
+    if options is None:
         print("Não foi possível encontrar o elemento select na página.")
         return []
     
-    options = select.find_all('option')
     city_info = []
-    for option in options:
-        if 'Selecione' not in option.text and option.get('value'):
-            value = option['value']
-            city_uf = option.text.strip()
+    for value, city_uf in options:
+        if 'Selecione' not in city_uf and value:
             city_code = value.split('/')[-1]
             city_info.append((city_code, city_uf))
     
     return city_info
 
 def get_company_data(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    response = requests.get(url, headers=headers)
+    response = http_get(url)
     return response.text
 
+# Regras estruturais da página /adesao/{cidade}, aplicadas à árvore do documento: cada participante
+# começa por um nome curto em negrito entre colchetes (às vezes precedido de "::maker" ou iniciado
+# por PIX), seguido do nome longo em negrito, do responsável e do e-mail (texto ou link mailto:).
+SHORT_NAME = re.compile(r'^(?:::\s*maker\s*)?\[\s*(?P<bracketed>[^\]]+?)\s*\]$|^(?P<pix>PIX\b.*)$', re.IGNORECASE)
+EMAIL = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+RESPONSIBLE_LABEL = re.compile(r'Respons[áa]vel\s*:?\s*(?P<name>.+?)\s*(?:\s[-–]\s|[,(:]|$)', re.IGNORECASE)
+REQUIRED_FIELDS = ('name_curto', 'name_longo', 'responsible', 'email')
+
+def document_events(node):
+    # Percorre a árvore na ordem do documento; cada negrito vira um único evento com o texto completo,
+    # mesmo com marcação aninhada, e links mailto: viram eventos de e-mail
+    for child in node.children():
+        tag = child.tag
+        if tag == '-text':
+            yield 'text', ' '.join(child.text().split())
+        elif tag in ('b', 'strong'):
+            yield 'bold', ' '.join(child.text().split())
+        elif not tag.startswith('-'):
+            href = (child.get('href') or '') if tag == 'a' else ''
+            if href.lower().startswith('mailto:'):
+                yield 'email', href[len('mailto:'):].split('?')[0].strip()
+            yield from document_events(child)
+
+def resolve_block(block):
+    # Nome longo: primeiro negrito após o nome curto. Responsável: último negrito antes do e-mail,
+    # um rótulo "Responsável:" no texto ou, se o e-mail vier antes, o primeiro negrito depois dele
+    before = [text for text, after_email in block['bolds'] if not after_email]
+    after = [text for text, after_email in block['bolds'] if after_email]
+    labelled = RESPONSIBLE_LABEL.search(' '.join(block['texts']))
+    company = {'name_curto': block['name_curto'], 'email': block.get('email')}
+    company['name_longo'] = before[0] if before else None
+    if len(before) >= 2:
+        company['responsible'] = before[-1]
+    elif labelled and labelled.group('name').strip():
+        company['responsible'] = labelled.group('name').strip()
+    elif before and after:
+        company['responsible'] = after[0]
+    if company['email']:
+        company['domain'] = company['email'].split('@', 1)[1].lower()
+    return company
+
+def extract_companies(html_content):
+    # Retorna as empresas resolvidas pelas regras e, para cada bloco que falhou nelas, um trecho
+    # compacto (negritos e texto do bloco) para o fallback
+    cleaned = clean_html(html_content)
+    tree = parse(cleaned)
+    root = tree.css_first('body') or tree
+    blocks = []
+    for kind, value in document_events(root):
+        if not value:
+            continue
+        email = EMAIL.search(value)
+        short_name = SHORT_NAME.match(value) if kind == 'bold' and not email else None
+        if short_name:
+            blocks.append({'name_curto': short_name.group('bracketed') or short_name.group('pix'),
+                           'bolds': [], 'texts': [], 'fragment': []})
+        if not blocks:
+            continue
+        block = blocks[-1]
+        block['fragment'].append(f"<b>{html.escape(value)}</b>" if kind == 'bold' else html.escape(value))
+        if short_name:
+            continue
+        if kind == 'text' and 'email' not in block:
+            block['texts'].append(value[:email.start()] if email else value)
+        if email and 'email' not in block:
+            block['email'] = email.group()
+        elif kind == 'bold' and not email:
+            block['bolds'].append((value, 'email' in block))
+
+    if not blocks:
+        # Página sem nenhum nome curto reconhecível: o HTML limpo da página segue para o fallback
+        return [], [cleaned]
+
+    companies, failed = [], []
+    for block in blocks:
+        company = resolve_block(block)
+        if all(company.get(field) for field in REQUIRED_FIELDS):
+            companies.append({key: company[key] for key in REQUIRED_FIELDS + ('domain',)})
+        else:
+            failed.append(' '.join(block['fragment']))
+    return companies, failed
+
 def process_company_data(html_content):
     prompt = f"""
     Extraia as seguintes informações das empresas listadas no HTML abaixo:
@@ -63,15 +149,36 @@ def process_company_data(html_content):
     {html_content}
     """
 
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Você é um assistente especializado em extrair informações de HTML."},
-            {"role": "user", "content": prompt}
-        ]
-    )
+    def ask_model():
+        response = openai.ChatCompletion.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "Você é um assistente especializado em extrair informações de HTML."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+        return response.choices[0].message['content']
+
+    # Gravada/reproduzida por http_replay quando HTTP_REPLAY_MODE está ativo
+    return replay_llm({'model': "gpt-4o-mini", 'prompt': prompt}, ask_model)
 
-    return response.choices[0].message['content']
+def gpt_fallback(failed, company_url):
+    # As chamadas dos workers de city_pool passam pelo limite por host de http_client; um 429 pausa
+    # todos os workers e é repetido com backoff. Qualquer outra falha descarta só os blocos do
+    # fallback, mantendo as empresas que as regras já extraíram da cidade
+    for attempt in range(LLM_RETRIES):
+        wait_for_host(LLM_HOST)
+        throttle_host(LLM_HOST, LLM_REQUESTS_PER_SECOND)
+        try:
+            return parse_gpt_response(process_company_data('\n'.join(failed)))
+        except Exception as e:
+            if is_rate_limit_error(e) and attempt < LLM_RETRIES - 1:
+                wait_time = LLM_RETRY_DELAY * (2 ** attempt)
+                print(f"GPT limitou a taxa em {company_url}. Aguardando {wait_time} segundos...")
+                pause_host(LLM_HOST, wait_time)
+                continue
+            print(f"Fallback via GPT falhou para {company_url} ({len(failed)} blocos não extraídos). Erro: {e}")
+            return []
 
 def parse_gpt_response(response):
     companies = []
@@ -102,6 +209,34 @@ def parse_gpt_response(response):
         companies.append(current_company)
     return companies
 
+def city_rows(city_code, city_uf):
+    # Roda num worker de city_pool: busca, extrai e monta as linhas de uma cidade
+    company_url = f'https://ix.br/adesao/{city_code}'
+    
+    print(f"Processando: {company_url}")
+    
+    html_content = get_company_data(company_url)
+    companies, failed = extract_companies(html_content)
+    if failed and LLM_FALLBACK:
+        # O GPT só recebe os blocos que as regras não resolveram, já sem scripts e navegação
+        companies += gpt_fallback(failed, company_url)
+    elif failed:
+        print(f"{len(failed)} blocos não reconhecidos em {company_url} (fallback via GPT desativado)")
+    
+    # Separar corretamente o nome da cidade e a UF
+    city_name, uf = city_uf.rsplit('/', 1)
+    
+    return [[
+        city_code,
+        city_name,
+        uf,
+        company.get('name_curto', ''),
+        company.get('name_longo', ''),
+        company.get('responsible', ''),
+        company.get('email', ''),
+        company.get('domain', '')
+    ] for company in companies]
+
 def main():
     base_url = 'https://ix.br'
     city_page_url = 'https://ix.br/trafego/pix/'
@@ -109,44 +244,26 @@ def main():
     city_info = get_city_info(city_page_url)
     
     os.makedirs('output', exist_ok=True)
+    rows = []
     output_file = os.path.join('output', 'ix-br_entities_data.csv')
+    invalidate_parquet('ix-br_entities_data')
     
     with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(['Sigla da Cidade', 'Nome da Cidade', 'UF do Estado', 'Nome curto Empresa', 'Nome longo Empresa', 'Nome do Responsável', 'E-mail', 'Domínio'])
+        writer.writerow(COLUMNS)
         
-        for city_code, city_uf in city_info:
-            company_url = f'https://ix.br/adesao/{city_code}'
-            
-            print(f"Processando: {company_url}")
-            
-            html_content = get_company_data(company_url)
-            gpt_response = process_company_data(html_content)
-            companies = parse_gpt_response(gpt_response)
-            
-            # Separar corretamente o nome da cidade e a UF
-            city_name, uf = city_uf.rsplit('/', 1)
-            
-            for company in companies:
-                writer.writerow([
-                    city_code,
-                    city_name,
-                    uf,
-                    company.get('name_curto', ''),
-                    company.get('name_longo', ''),
-                    company.get('responsible', ''),
-                    company.get('email', ''),
-                    company.get('domain', '')
-                ])
-            
-            print(f"Dados processados e salvos para {city_name}")
-            
-            # Salva o CSV após processar cada cidade
+        def write_rows(city_code, city_uf, new_rows):
+            # Chamado na ordem de city_info, mesmo com as cidades processadas em paralelo
+            rows.extend(new_rows)
+            writer.writerows(new_rows)
             csvfile.flush()
-            os.fsync(csvfile.fileno())
-            
-            time.sleep(1)  # Pausa de 1 segundo entre as requisições
+            print(f"Dados processados e salvos para {city_uf}")
+        
+        process_cities(city_info, city_rows, write_rows)
+        os.fsync(csvfile.fileno())
     
+    # O CSV gravado cidade a cidade serve de exportação; a tabela principal é gravada com esquema
+    write_table(pd.DataFrame(rows, columns=COLUMNS), 'ix-br_entities_data', export_csv=False)
     print(f"Todos os dados foram salvos em: {output_file}")
 
 if __name__ == '__main__':
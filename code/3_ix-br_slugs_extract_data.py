@@ -1,51 +1,43 @@
-import requests
-from bs4 import BeautifulSoup
+from http_client import http_get
+from storage import invalidate_parquet, write_table
+from city_pool import process_cities
+from html_parser import map_areas, select_options
 import csv
 import os
-import time
+import pandas as pd
 import re
 
+COLUMNS = ['Sigla da Cidade', 'Nome da Cidade', 'UF do Estado', 'Nome curto Empresa', 'Slug', 'Nome longo Empresa', 'Coordenadas']
+
 def get_city_info(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    response = requests.get(url, headers=headers)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    
-    select = soup.find('select', {'id': 'router'})
+    response = http_get(url)
+    options = select_options(response.text, 'select#router')
     
-    if not select:
+    if options is None:
         print("Não foi possível encontrar o elemento select na página.")
         return []
     
-    options = select.find_all('option')
     city_info = []
-    for option in options:
-        if option.get('value'):
-            value = option['value']
-            city_uf = option.text.strip()
+    for value, city_uf in options:
+        if value:
             city_code = value.split('/')[-1]
             city_info.append((city_code, city_uf))
     
     return city_info
 
 def get_company_data(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    response = requests.get(url, headers=headers)
+    response = http_get(url)
     return response.text
 
 def extract_map_data(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    map_tag = soup.find('map')
+    areas = map_areas(html_content)
     
-    if not map_tag:
+    if areas is None:
         print("Não foi possível encontrar a tag 'map' na página.")
         return []
     
     companies = []
-    for area in map_tag.find_all('area'):
+    for area in areas:
         company = {}
         company['name_curto'] = area.get('alt', '')
         href = area.get('href', '')
@@ -57,6 +49,34 @@ def extract_map_data(html_content):
     
     return companies
 
+def split_city_uf(city_uf):
+    # Separar corretamente o nome da cidade e a UF
+    city_parts = city_uf.split('/')
+    if len(city_parts) >= 2:
+        return ' '.join(city_parts[:-1]).strip(), city_parts[-1].strip()
+    return city_uf, ''
+
+def company_rows(city_code, city_uf, companies):
+    city_name, uf = split_city_uf(city_uf)
+    return [[
+        city_code,
+        city_name,
+        uf,
+        company['name_curto'],
+        company['slug'],
+        company['name_longo'],
+        company['coords']
+    ] for company in companies]
+
+def city_rows(city_code, city_uf):
+    # Roda num worker de city_pool: busca e extrai os participantes de uma cidade
+    company_url = f'https://ix.br/trafego/pix/{city_code}'
+    
+    print(f"Processando: {company_url}")
+    
+    html_content = get_company_data(company_url)
+    return company_rows(city_code, city_uf, extract_map_data(html_content))
+
 def main():
     base_url = 'https://ix.br'
     city_page_url = 'https://ix.br/trafego/pix/'
@@ -64,48 +84,26 @@ def main():
     city_info = get_city_info(city_page_url)
     
     os.makedirs('output', exist_ok=True)
+    rows = []
     output_file = os.path.join('output', 'ix-br_slugs_data.csv')
+    invalidate_parquet('ix-br_slugs_data')
     
     with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(['Sigla da Cidade', 'Nome da Cidade', 'UF do Estado', 'Nome curto Empresa', 'Slug', 'Nome longo Empresa', 'Coordenadas'])
+        writer.writerow(COLUMNS)
         
-        for city_code, city_uf in city_info:
-            company_url = f'https://ix.br/trafego/pix/{city_code}'
-            
-            print(f"Processando: {company_url}")
-            
-            html_content = get_company_data(company_url)
-            companies = extract_map_data(html_content)
-            
-            # Separar corretamente o nome da cidade e a UF
-            city_parts = city_uf.split('/')
-            if len(city_parts) >= 2:
-                city_name = ' '.join(city_parts[:-1]).strip()
-                uf = city_parts[-1].strip()
-            else:
-                city_name = city_uf
-                uf = ''
-            
-            for company in companies:
-                writer.writerow([
-                    city_code,
-                    city_name,
-                    uf,
-                    company['name_curto'],
-                    company['slug'],
-                    company['name_longo'],
-                    company['coords']
-                ])
-            
-            print(f"Dados processados e salvos para {city_name}")
-            
-            # Salva o CSV após processar cada cidade
+        def write_rows(city_code, city_uf, new_rows):
+            # Chamado na ordem de city_info, mesmo com as cidades processadas em paralelo
+            rows.extend(new_rows)
+            writer.writerows(new_rows)
             csvfile.flush()
-            os.fsync(csvfile.fileno())
-            
-            time.sleep(1)  # Pausa de 1 segundo entre as requisições
+            print(f"Dados processados e salvos para {split_city_uf(city_uf)[0]}")
+        
+        process_cities(city_info, city_rows, write_rows)
+        os.fsync(csvfile.fileno())
     
+    # O CSV gravado cidade a cidade serve de exportação; a tabela principal é gravada com esquema
+    write_table(pd.DataFrame(rows, columns=COLUMNS), 'ix-br_slugs_data', export_csv=False)
     print(f"Todos os dados foram salvos em: {output_file}")
 
 if __name__ == '__main__':
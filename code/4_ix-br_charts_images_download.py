@@ -1,12 +1,39 @@
+import asyncio
 import csv
 import os
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from http_client import http_get, MAX_RETRIES
+from storage import read_table
+from image_manifest import (cached_image_url, download_image_file, fetch_image, forget_image,
+                            load_manifest, needs_download, save_manifest)
+from html_parser import img_src, img_srcs
+from urllib.parse import urljoin, urlsplit
+from tqdm import tqdm
 
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
+ASYNC_DOWNLOAD = True
+MAX_CONCURRENT_DOWNLOADS = 16  # Slugs processados simultaneamente
+REQUESTS_PER_SECOND_PER_HOST = 10
+GRAPH_TYPES = ['Daily', 'Weekly', 'Monthly', 'Yearly', 'Decadely']
+# O gráfico diário muda a cada execução e alimenta o histórico: é revalidado com GET condicional
+REFRESH_GRAPH_TYPES = {'Daily'}
+
+class HostRateLimiter:
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self.next_slot = {}
+        self.lock = asyncio.Lock()
+
+    async def wait(self, url):
+        host = urlsplit(url).netloc
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            now = loop.time()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        await asyncio.sleep(slot - now)
 
 def select_graph_type():
     print("Selecione o tipo de gráfico para download:")
@@ -19,71 +46,60 @@ def select_graph_type():
     while True:
         choice = input("Digite o número da opção desejada: ")
         if choice in ['1', '2', '3', '4', '5']:
-            options = ['Daily', 'Weekly', 'Monthly', 'Yearly', 'Decadely']
-            return options[int(choice) - 1]
+            return GRAPH_TYPES[int(choice) - 1]
         else:
             print("Opção inválida. Por favor, tente novamente.")
 
-def download_image(url, output_path, city_code, slug, graph_type, retries=MAX_RETRIES):
+def chart_filename(city_code, slug, graph_type):
+    return f"pix__{city_code.lower()}__{slug}__bps__{graph_type.lower()}.png"
+
+def find_chart_src(html, graph_type):
+    return img_src(html, f'img[alt="{graph_type}"]')
+
+def download_image(url, output_path, city_code, slug, graph_type, retries=MAX_RETRIES, manifest=None):
+    img_filename = chart_filename(city_code, slug, graph_type)
+    img_path = os.path.join(output_path, img_filename)
+
+    # Verificação antes de qualquer requisição: imagens existentes não custam nada
+    if not needs_download(img_path, refresh=graph_type in REFRESH_GRAPH_TYPES):
+        print(f"Imagem já existe: {img_filename}. Pulando download.")
+        return img_filename
+
     print(f"Verificando imagem de: {url}")
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
-    for attempt in range(retries):
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            img = soup.find('img', alt=graph_type)
-            if img:
-                img_url = urljoin(url, img['src'])
-                img_filename = f"pix__{city_code.lower()}__{slug}__bps__{graph_type.lower()}.png"
-                img_path = os.path.join(output_path, img_filename)
-                
-                if os.path.exists(img_path):
-                    print(f"Imagem já existe: {img_filename}. Pulando download.")
-                    return img_filename
-                
-                img_response = requests.get(img_url, headers=headers, timeout=10)
-                img_response.raise_for_status()
-                
-                with open(img_path, 'wb') as f:
-                    f.write(img_response.content)
-                
-                print(f"Imagem baixada com sucesso: {img_filename}")
-                return img_filename
-            else:
-                print(f"Imagem {graph_type} não encontrada em: {url}")
-                return None
-        except requests.RequestException as e:
-            print(f"Tentativa {attempt + 1} falhou. Erro: {e}")
-            if attempt < retries - 1:
-                print(f"Tentando novamente em {RETRY_DELAY} segundos...")
-                time.sleep(RETRY_DELAY)
-            else:
-                print(f"Todas as {retries} tentativas falharam para {url}")
-                return None
+    if manifest is None:
+        manifest = {}
+    try:
+        changed = download_image_file(manifest, url, img_path, lambda html: find_chart_src(html, graph_type), retries=retries)
+        if changed is None:
+            print(f"Imagem {graph_type} não encontrada em: {url}")
+            return None
+        if changed:
+            print(f"Imagem baixada com sucesso: {img_filename}")
+        else:
+            print(f"Imagem inalterada: {img_filename}")
+        return img_filename
+    except requests.RequestException as e:
+        print(f"Falha ao acessar {url} após {retries} tentativas. Erro: {e}")
+        return None
 
 def process_csv(input_file, output_path, graph_type):
     os.makedirs(output_path, exist_ok=True)
+    manifest = load_manifest(output_path)
     
     print(f"Lendo arquivo de entrada: {input_file}")
     with open(input_file, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        total_rows = sum(1 for row in csvfile) - 1  # Count total rows (excluding header)
-        csvfile.seek(0)  # Reset file pointer
-        next(reader)  # Skip header row
+        # DictReader já consome o cabeçalho; uma única passada carrega as linhas e dá o total
+        rows = list(csv.DictReader(csvfile))
+        total_rows = len(rows)
         
-        for i, row in enumerate(reader, 1):
+        for i, row in enumerate(rows, 1):
             print(f"\nProcessando linha {i} de {total_rows}")
             city_code = row['Sigla da Cidade']
             slug = row['Slug']
             
             if slug:
                 url = f'https://ix.br/trafego/pix/{city_code}/{slug}/bps'
-                downloaded_image = download_image(url, output_path, city_code, slug, graph_type)
+                downloaded_image = download_image(url, output_path, city_code, slug, graph_type, manifest=manifest)
                 if downloaded_image:
                     print(f"Imagem para {slug} baixada: {downloaded_image}")
                 else:
@@ -91,85 +107,165 @@ def process_csv(input_file, output_path, graph_type):
             else:
                 print("Slug da empresa não disponível, pulando download da imagem")
 
+    save_manifest(manifest, output_path)
+
+def find_chart_srcs(html, graph_types):
+    # Um único parse da página serve para todos os períodos
+    return img_srcs(html, graph_types)
+
+async def download_chart_async(manifest, img_path, img_url, resolved_at, rate_limiter):
+    await rate_limiter.wait(img_url)
+    await asyncio.to_thread(fetch_image, manifest, img_path, img_url, resolved_at)
+
+async def download_slug_charts_async(url, output_path, city_code, slug, graph_types, semaphore, rate_limiter, manifest):
+    img_paths = {graph_type: os.path.join(output_path, chart_filename(city_code, slug, graph_type))
+                 for graph_type in graph_types}
+    pending = [graph_type for graph_type in graph_types
+               if needs_download(img_paths[graph_type], refresh=graph_type in REFRESH_GRAPH_TYPES)]
+    if not pending:
+        return len(graph_types)
+
+    async with semaphore:
+        img_urls = {}
+        for graph_type in pending:
+            img_url = cached_image_url(manifest, os.path.basename(img_paths[graph_type]))
+            if img_url:
+                img_urls[graph_type] = (img_url, None)
+        try:
+            if len(img_urls) < len(pending):
+                await rate_limiter.wait(url)
+                response = await asyncio.to_thread(http_get, url)
+                resolved_at = time.time()
+                for graph_type, img_src in find_chart_srcs(response.text, pending).items():
+                    img_urls[graph_type] = (urljoin(url, img_src), resolved_at)
+        except requests.RequestException as e:
+            tqdm.write(f"Falha ao acessar {url}. Erro: {e}")
+
+        missing = [graph_type for graph_type in pending if graph_type not in img_urls]
+        if missing:
+            tqdm.write(f"Imagens {', '.join(missing)} não encontradas em: {url}")
+
+        downloads = [graph_type for graph_type in pending if graph_type in img_urls]
+        results = await asyncio.gather(*[
+            download_chart_async(manifest, img_paths[graph_type], *img_urls[graph_type], rate_limiter)
+            for graph_type in downloads
+        ], return_exceptions=True)
+
+        failed = 0
+        for graph_type, result in zip(downloads, results):
+            if isinstance(result, requests.RequestException):
+                if img_urls[graph_type][1] is None:
+                    forget_image(manifest, os.path.basename(img_paths[graph_type]))
+                tqdm.write(f"Falha ao baixar imagem {graph_type} para {slug}. Erro: {result}")
+                failed += 1
+            elif isinstance(result, Exception):
+                raise result
+        return len(graph_types) - len(missing) - failed
+
+def read_slugs(input_table):
+    # Só as duas colunas usadas são lidas da tabela de slugs
+    df = read_table(input_table, columns=['Sigla da Cidade', 'Slug']).dropna(subset=['Slug'])
+    df = df[df['Slug'] != ''].drop_duplicates()
+    return list(zip(df['Sigla da Cidade'], df['Slug']))
+
+async def process_csv_async(input_table, output_path, graph_types,
+                            max_concurrent=MAX_CONCURRENT_DOWNLOADS,
+                            requests_per_second=REQUESTS_PER_SECOND_PER_HOST):
+    os.makedirs(output_path, exist_ok=True)
+    # As chamadas bloqueantes ao http_client rodam em threads; o pool acompanha o limite de concorrência
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max_concurrent))
+
+    print(f"Lendo tabela de entrada: {input_table}")
+    slugs = read_slugs(input_table)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    rate_limiter = HostRateLimiter(requests_per_second)
+    manifest = load_manifest(output_path)
+
+    tasks = [
+        download_slug_charts_async(f'https://ix.br/trafego/pix/{city_code}/{slug}/bps',
+                                   output_path, city_code, slug, graph_types, semaphore, rate_limiter, manifest)
+        for city_code, slug in slugs
+    ]
+
+    available = 0
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc=f"Charts {', '.join(graph_types)}"):
+        available += await task
+    save_manifest(manifest, output_path)
+    print(f"Imagens disponíveis: {available} de {len(tasks) * len(graph_types)}")
+
 if __name__ == '__main__':
+    input_table = 'ix-br_slugs_data'
     input_file = 'output/ix-br_slugs_data.csv'
     output_path = 'output/img/charts'
-    graph_type = select_graph_type()
-    process_csv(input_file, output_path, graph_type)
+    # '--all' baixa todos os períodos sem interação, com uma única requisição de página por slug
+    if '--all' in sys.argv:
+        asyncio.run(process_csv_async(input_table, output_path, GRAPH_TYPES))
+    else:
+        graph_type = select_graph_type()
+        if ASYNC_DOWNLOAD:
+            asyncio.run(process_csv_async(input_table, output_path, [graph_type]))
+        else:
+            process_csv(input_file, output_path, graph_type)
     print(f"Download de imagens concluído. As imagens foram salvas em: {output_path}")
 import csv
 import os
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
-import time
+from http_client import MAX_RETRIES
+from image_manifest import download_image_file, load_manifest, needs_download, save_manifest
+from html_parser import img_src
 
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
+def find_map_src(html):
+    return img_src(html, 'img[usemap="#map"]')
+
+def download_city_map(url, output_path, city_code, retries=MAX_RETRIES, manifest=None):
+    img_filename = f"map__{city_code.lower()}.png"
+    img_path = os.path.join(output_path, img_filename)
+
+    # Verificação antes de qualquer requisição: mapas existentes não custam nada
+    if not needs_download(img_path):
+        print(f"Mapa já existe: {img_filename}. Pulando download.")
+        return img_filename
 
-def download_city_map(url, output_path, city_code, retries=MAX_RETRIES):
     print(f"Verificando mapa da cidade: {url}")
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
-    for attempt in range(retries):
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            img = soup.find('img', attrs={'usemap': '#map'})
-            if img:
-                img_url = urljoin(url, img['src'])
-                img_filename = f"map__{city_code.lower()}.png"
-                img_path = os.path.join(output_path, img_filename)
-                
-                if os.path.exists(img_path):
-                    print(f"Mapa já existe: {img_filename}. Pulando download.")
-                    return img_filename
-                
-                img_response = requests.get(img_url, headers=headers, timeout=10)
-                img_response.raise_for_status()
-                
-                with open(img_path, 'wb') as f:
-                    f.write(img_response.content)
-                
-                print(f"Mapa baixado com sucesso: {img_filename}")
-                return img_filename
-            else:
-                print(f"Mapa não encontrado em: {url}")
-                return None
-        except requests.RequestException as e:
-            print(f"Tentativa {attempt + 1} falhou. Erro: {e}")
-            if attempt < retries - 1:
-                print(f"Tentando novamente em {RETRY_DELAY} segundos...")
-                time.sleep(RETRY_DELAY)
-            else:
-                print(f"Todas as {retries} tentativas falharam para {url}")
-                return None
+    if manifest is None:
+        manifest = {}
+    try:
+        changed = download_image_file(manifest, url, img_path, find_map_src, retries=retries)
+        if changed is None:
+            print(f"Mapa não encontrado em: {url}")
+            return None
+        if changed:
+            print(f"Mapa baixado com sucesso: {img_filename}")
+        else:
+            print(f"Mapa inalterado: {img_filename}")
+        return img_filename
+    except requests.RequestException as e:
+        print(f"Falha ao acessar {url} após {retries} tentativas. Erro: {e}")
+        return None
 
 def process_csv(input_file, output_path):
     os.makedirs(output_path, exist_ok=True)
+    manifest = load_manifest(output_path)
     
     print(f"Lendo arquivo de entrada: {input_file}")
     with open(input_file, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        total_rows = sum(1 for row in csvfile) - 1  # Count total rows (excluding header)
-        csvfile.seek(0)  # Reset file pointer
-        next(reader)  # Skip header row
+        # DictReader já consome o cabeçalho; uma única passada carrega as linhas e dá o total
+        rows = list(csv.DictReader(csvfile))
+        total_rows = len(rows)
         
-        for i, row in enumerate(reader, 1):
+        for i, row in enumerate(rows, 1):
             print(f"\nProcessando linha {i} de {total_rows}")
             city_code = row['Sigla da Cidade']
             
             url = f'https://ix.br/trafego/pix/{city_code}'
-            downloaded_map = download_city_map(url, output_path, city_code)
+            downloaded_map = download_city_map(url, output_path, city_code, manifest=manifest)
             if downloaded_map:
                 print(f"Mapa para {city_code} baixado: {downloaded_map}")
             else:
                 print(f"Falha ao baixar mapa para {city_code}")
 
+    save_manifest(manifest, output_path)
+
 if __name__ == '__main__':
     input_file = 'output/ix-br_slugs_data.csv'
     output_path = 'output/city_maps'
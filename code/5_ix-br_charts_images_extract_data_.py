@@ -1,15 +1,21 @@
+import asyncio
 import os
 import csv
-from datetime import date
 import base64
 from dotenv import load_dotenv
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 import pandas as pd
-import time
 import logging
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from extraction_cache import get_cached, image_key, put_cached
+from chart_reader import load_glyphs, read_chart, reader_version
+from extraction_scheduler import ExtractionScheduler
+from http_replay import areplay_llm, replaying
+from storage import read_table, table_exists
+from history import append_snapshot
+from image_manifest import image_date
+from extraction_results import ResultLog, apply_results, compact, replay_log, result_log_path
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,46 +24,74 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 load_dotenv()
 
 # Get API key from environment variable
+# The model is only a fallback for charts the local reader cannot parse
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
-    raise ValueError("No OpenAI API key found. Please check your .env file.")
+    logging.warning("No OpenAI API key found. Charts the local reader cannot parse will fail.")
 
-# Configuration
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
-MAX_WORKERS = 4  # Number of parallel processes
+# Configuration (rate limits and concurrency live in extraction_scheduler)
+
+USE_LOCAL_READER = True  # Try the deterministic pixel reader before calling the model
+
+MODEL_NAME = "gpt-4o-mini"
+EXTRACTION_PROMPT = (
+    "Extract the following data from this image:\n"
+    "Input Maximum: <value> <unit> Average: <value> <unit> Current: <value> <unit>\n"
+    "Output Maximum: <value> <unit> Average: <value> <unit> Current: <value> <unit>\n"
+    "Where <value> is a decimal number with two decimal places and <unit> is usually 'Gbps'.\n"
+    "Respond only with the extracted data in the exact format specified, nothing else."
+)
+
+EXTRACTION_COLUMNS = ['Input_Maximum', 'Input_Maximum_Unit', 'Input_Average', 'Input_Average_Unit',
+                      'Input_Current', 'Input_Current_Unit', 'Output_Maximum', 'Output_Maximum_Unit',
+                      'Output_Average', 'Output_Average_Unit', 'Output_Current', 'Output_Current_Unit',
+                      'Extraction_Date']
+# Charts are stored per city: a participant present in several PIX cities has one row and one chart per city
+RESULT_KEY = ['Sigla da Cidade', 'Slug']
 
 # Initialize the ChatOpenAI model
-chat = ChatOpenAI(model="gpt-4o-mini", max_tokens=300)
+chat = ChatOpenAI(model=MODEL_NAME, max_tokens=300) if api_key else None
+
+# Glyph templates for chart_reader, learned from model extractions by the pipeline's 'glyphs' stage
+# (python chart_reader.py --learn ix-br_slugs_data_processed output/img/charts)
+glyphs = load_glyphs() if USE_LOCAL_READER else {}
+# Local reads are cached apart from model answers, under a key tied to the reader code and glyphs
+LOCAL_READER_KEY = f"chart_reader:{reader_version()}" if USE_LOCAL_READER else None
 
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
-def process_image(image_path):
-    base64_image = encode_image(image_path)
+async def process_image(image_path, scheduler):
+    base64_image = await asyncio.to_thread(encode_image, image_path)
     
     messages = [
         SystemMessage(content="You are an AI assistant that analyzes images and extracts specific data from them."),
         HumanMessage(content=[
-            {"type": "text", "text": "Extract the following data from this image:\n"
-             "Input Maximum: <value> <unit> Average: <value> <unit> Current: <value> <unit>\n"
-             "Output Maximum: <value> <unit> Average: <value> <unit> Current: <value> <unit>\n"
-             "Where <value> is a decimal number with two decimal places and <unit> is usually 'Gbps'.\n"
-             "Respond only with the extracted data in the exact format specified, nothing else."},
+            {"type": "text", "text": EXTRACTION_PROMPT},
             {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
         ])
     ]
     
-    response = chat(messages)
-    return response.content
+    async def ask_model():
+        response = await chat.ainvoke(messages)
+        return response.content
+
+    # Recorded/replayed by http_replay when HTTP_REPLAY_MODE is set
+    payload = {'model': MODEL_NAME, 'prompt': EXTRACTION_PROMPT, 'image': base64_image}
+    return await scheduler.call(lambda: areplay_llm(payload, ask_model))
 
-def update_csv(df, extracted_data, slug):
+def chart_path(image_dir, city_code, slug):
+    return os.path.join(image_dir, f"pix__{city_code}__{slug}__bps__daily.png")
+
+def parse_extraction(extracted_data, extraction_date):
+    # extraction_date is the day the chart image was fetched, so cached reads of an unchanged
+    # chart keep their original date instead of looking like a new daily value
     lines = extracted_data.strip().split('\n')
     input_data = lines[0].split()
     output_data = lines[1].split()
     
-    update_data = {
+    return {
         'Input_Maximum': input_data[2],
         'Input_Maximum_Unit': input_data[3],
         'Input_Average': input_data[5],
@@ -70,670 +104,110 @@ def update_csv(df, extracted_data, slug):
         'Output_Average_Unit': output_data[6],
         'Output_Current': output_data[8],
         'Output_Current_Unit': output_data[9],
-        'Extraction_Date': date.today().isoformat()
+        'Extraction_Date': extraction_date
     }
-    
-    df.loc[df['Slug'] == slug, update_data.keys()] = update_data.values()
-    return df
 
-def is_row_processed(row):
-    return pd.notna(row['Input_Maximum']) and pd.notna(row['Output_Maximum']) and \
-           row['Input_Maximum'] != '' and row['Output_Maximum'] != ''
-
-def process_single_image(args):
-    index, row, image_dir = args
-    slug = row['Slug']
-    city_code = row['Sigla da Cidade']
-    image_path = os.path.join(image_dir, f"pix__{city_code}__{slug}__bps__daily.png")
-    
-    if is_row_processed(row):
-        return index, None, "skipped"
+async def process_single_image(index, slug, city_code, image_dir, scheduler):
+    image_path = chart_path(image_dir, city_code, slug)
     
     if not os.path.exists(image_path):
         return index, None, "error"
     
-    for attempt in range(MAX_RETRIES):
+    # The cache is keyed by the image content, so unchanged charts are never extracted twice
+    # and a re-downloaded chart with new content is extracted again even if the row is filled
+    cache_key = image_key(image_path, EXTRACTION_PROMPT, MODEL_NAME)
+    local_key = image_key(image_path, EXTRACTION_PROMPT, LOCAL_READER_KEY) if USE_LOCAL_READER else None
+    for key in filter(None, (local_key, cache_key)):
+        cached_data = get_cached(key)
+        if cached_data is not None:
+            return index, cached_data, "cached"
+    
+    extracted_data = None
+    if USE_LOCAL_READER:
         try:
-            extracted_data = process_image(image_path)
-            return index, extracted_data, "success"
+            extracted_data = await asyncio.to_thread(read_chart, image_path, glyphs)
         except Exception as e:
-            if attempt == MAX_RETRIES - 1:
-                return index, None, f"error: {str(e)}"
-            time.sleep(RETRY_DELAY)
-
-def main():
-    input_csv_path = "output/ix-br_slugs_data.csv"
-    output_csv_path = "output/ix-br_slugs_data_processed.csv"
-    image_dir = "output/img/charts"
-
-    if os.path.exists(output_csv_path):
-        logging.info(f"Output CSV file already exists. Reading from {output_csv_path}")
-        df = pd.read_csv(output_csv_path)
-    else:
-        logging.info(f"Output CSV file does not exist. Reading from {input_csv_path}")
-        df = pd.read_csv(input_csv_path)
-        new_columns = ['Input_Maximum', 'Input_Maximum_Unit', 'Input_Average', 'Input_Average_Unit',
-                       'Input_Current', 'Input_Current_Unit', 'Output_Maximum', 'Output_Maximum_Unit',
-                       'Output_Average', 'Output_Average_Unit', 'Output_Current', 'Output_Current_Unit',
-                       'Extraction_Date']
-        for col in new_columns:
-            if col not in df.columns:
-                df[col] = pd.NA
-
-    total_images = len(df)
-    logging.info(f"Starting processing of {total_images} images...")
-
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_single_image, (index, row, image_dir)) for index, row in df.iterrows()]
-        
-        processed_images = 0
-        skipped_images = 0
-        errors = 0
-        
-        for future in tqdm(as_completed(futures), total=total_images, desc="Processing Images"):
-            index, extracted_data, status = future.result()
-            if status == "success":
-                df = update_csv(df, extracted_data, df.loc[index, 'Slug'])
-                processed_images += 1
-            elif status == "skipped":
-                skipped_images += 1
-            else:
+            logging.warning(f"Local reader failed for {image_path}: {e}")
+    if extracted_data:
+        put_cached(local_key, extracted_data)
+        return index, extracted_data, "success"
+    if chat is None and not replaying():
+        return index, None, "error: local reader failed and no OpenAI API key is configured"
+    
+    # Retries and 429 backoff are handled by the scheduler
+    try:
+        extracted_data = await process_image(image_path, scheduler)
+    except Exception as e:
+        return index, None, f"error: {str(e)}"
+    put_cached(cache_key, extracted_data)
+    return index, extracted_data, "success"
+
+async def process_images(df, image_dir, result_log, replayed):
+    scheduler = ExtractionScheduler()
+    # Only the fields each job needs are passed; no row objects are copied around
+    # Charts already recorded in the result log by an interrupted run are not extracted again
+    tasks = [process_single_image((city_code, slug), slug, city_code, image_dir, scheduler)
+             for city_code, slug in zip(df['Sigla da Cidade'], df['Slug'])
+             if (city_code, slug) not in replayed]
+    
+    processed_images = 0
+    skipped_images = len(df) - len(tasks)
+    errors = 0
+    results = {}
+    
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing Images"):
+        key, extracted_data, status = await task
+        if status in ("success", "cached"):
+            try:
+                results[key] = parse_extraction(extracted_data, image_date(chart_path(image_dir, *key)))
+            except IndexError:
+                logging.error(f"Unexpected response format for {key}: {extracted_data!r}")
                 errors += 1
-            
-            if processed_images % 10 == 0:
-                df.to_csv(output_csv_path, index=False)
-                logging.info(f"CSV file saved. Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
-
-    df.to_csv(output_csv_path, index=False)
-    logging.info(f"Processing complete. Total images: {total_images}, Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
-    logging.info(f"CSV file updated: {output_csv_path}")
-
-if __name__ == "__main__":
-    main()
-import os
-import csv
-from datetime import date
-import base64
-from dotenv import load_dotenv
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-import pandas as pd
-import time
-import logging
-from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Get API key from environment variable
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("No OpenAI API key found. Please check your .env file.")
-
-# Configuration
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
-MAX_WORKERS = 4  # Number of parallel processes
-
-# Initialize the ChatOpenAI model
-chat = ChatOpenAI(model="gpt-4-vision-preview", max_tokens=300)
-
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-def process_image(image_path):
-    base64_image = encode_image(image_path)
-    
-    messages = [
-        SystemMessage(content="You are an AI assistant that analyzes topology map images and extracts specific data from them."),
-        HumanMessage(content=[
-            {"type": "text", "text": "Extract the following data from this topology map image:\n"
-             "PIX-A: <name>\n"
-             "Download_value: <value><unit>\n"
-             "Download_percentage: <percentage>%\n"
-             "Upload_value: <value><unit>\n"
-             "Upload_percentage: <percentage>%\n"
-             "PIX-B: <name>\n"
-             "Where <name> is the name of the PIX, <value> is a number, <unit> is K, M, G, or T, and <percentage> is a number.\n"
-             "If percentage is not available in the image, use '-' as the value.\n"
-             "If there are multiple connections, provide data for the one with the highest download value.\n"
-             "Respond only with the extracted data in the exact format specified, nothing else."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
-        ])
-    ]
-    
-    response = chat(messages)
-    return response.content
-
-def update_csv(df, extracted_data, city_code):
-    lines = extracted_data.strip().split('\n')
-    data = {}
-    for line in lines:
-        key, value = line.split(': ')
-        data[key] = value
-    
-    update_data = {
-        'Sigla da Cidade': city_code,
-        'PIX-A': data['PIX-A'],
-        'Download_valor': data['Download_value'],
-        'Download_porcentagem': data['Download_percentage'],
-        'Upload_valor': data['Upload_value'],
-        'Upload_porcentagem': data['Upload_percentage'],
-        'PIX-B': data['PIX-B'],
-        'Extraction_Date': date.today().isoformat()
-    }
-    
-    df = df.append(update_data, ignore_index=True)
-    return df
-
-def is_row_processed(df, city_code):
-    return not df[df['Sigla da Cidade'] == city_code].empty
-
-def process_single_image(args):
-    city_code, image_dir = args
-    image_path = os.path.join(image_dir, f"pix__{city_code}__topology.png")
-    
-    if not os.path.exists(image_path):
-        return city_code, None, "error"
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            extracted_data = process_image(image_path)
-            return city_code, extracted_data, "success"
-        except Exception as e:
-            if attempt == MAX_RETRIES - 1:
-                return city_code, None, f"error: {str(e)}"
-            time.sleep(RETRY_DELAY)
-
-def main():
-    input_csv_path = "output/ix-br_slugs_data.csv"
-    output_csv_path = "output/ix-br_topologymaps_data.csv"
-    image_dir = "output/img/topologymaps"
-
-    if os.path.exists(output_csv_path):
-        logging.info(f"Output CSV file already exists. Reading from {output_csv_path}")
-        df = pd.read_csv(output_csv_path)
-    else:
-        logging.info(f"Output CSV file does not exist. Creating new DataFrame")
-        df = pd.DataFrame(columns=['Sigla da Cidade', 'PIX-A', 'Download_valor', 'Download_porcentagem',
-                                   'Upload_valor', 'Upload_porcentagem', 'PIX-B', 'Extraction_Date'])
-
-    input_df = pd.read_csv(input_csv_path)
-    city_codes = input_df['Sigla da Cidade'].unique()
-
-    total_images = len(city_codes)
-    logging.info(f"Starting processing of {total_images} images...")
-
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_single_image, (city_code, image_dir)) for city_code in city_codes]
-        
-        processed_images = 0
-        skipped_images = 0
-        errors = 0
-        
-        for future in tqdm(as_completed(futures), total=total_images, desc="Processing Images"):
-            city_code, extracted_data, status = future.result()
+                continue
+            result_log.append(key, results[key])
             if status == "success":
-                df = update_csv(df, extracted_data, city_code)
                 processed_images += 1
-            elif status == "skipped":
-                skipped_images += 1
             else:
-                errors += 1
-            
-            if processed_images % 10 == 0:
-                df.to_csv(output_csv_path, index=False)
-                logging.info(f"CSV file saved. Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
-
-    df.to_csv(output_csv_path, index=False)
-    logging.info(f"Processing complete. Total images: {total_images}, Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
-    logging.info(f"CSV file updated: {output_csv_path}")
-
-if __name__ == "__main__":
-    main()
-import os
-import csv
-from datetime import date
-import base64
-from dotenv import load_dotenv
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-import pandas as pd
-import time
-import logging
-from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Get API key from environment variable
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("No OpenAI API key found. Please check your .env file.")
-
-# Configuration
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
-MAX_WORKERS = 4  # Number of parallel processes
-
-# Initialize the ChatOpenAI model
-chat = ChatOpenAI(model="gpt-4-vision-preview", max_tokens=300)
-
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-def process_image(image_path):
-    base64_image = encode_image(image_path)
-    
-    messages = [
-        SystemMessage(content="You are an AI assistant that analyzes topology map images and extracts specific data from them."),
-        HumanMessage(content=[
-            {"type": "text", "text": "Extract the following data from this topology map image:\n"
-             "PIX-A: <name>\n"
-             "Download_valor: <value><unit>\n"
-             "Download_porcentagem: <percentage>%\n"
-             "Upload_valor: <value><unit>\n"
-             "Upload_porcentagem: <percentage>%\n"
-             "PIX-B: <name>\n"
-             "Where <name> is the name of the PIX, <value> is a number, <unit> is K, M, G, or T, and <percentage> is a number.\n"
-             "If percentage is not available in the image, use the value from the legend based on the arrow color.\n"
-             "If there are multiple connections, provide data for the one with the highest download value.\n"
-             "For 1-to-N or 1-to-'PIX Central' topologies, focus on the main connection.\n"
-             "Respond only with the extracted data in the exact format specified, nothing else."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
-        ])
-    ]
-    
-    response = chat(messages)
-    return response.content
-
-def update_csv(df, extracted_data, city_code):
-    lines = extracted_data.strip().split('\n')
-    data = {}
-    for line in lines:
-        key, value = line.split(': ')
-        data[key] = value
-    
-    update_data = {
-        'Sigla da Cidade': city_code,
-        'PIX-A': data['PIX-A'],
-        'Download_valor': data['Download_valor'],
-        'Download_porcentagem': data['Download_porcentagem'],
-        'Upload_valor': data['Upload_valor'],
-        'Upload_porcentagem': data['Upload_porcentagem'],
-        'PIX-B': data['PIX-B'],
-        'Extraction_Date': date.today().isoformat()
-    }
-    
-    df = df.append(update_data, ignore_index=True)
-    return df
-
-def is_row_processed(df, city_code):
-    return not df[df['Sigla da Cidade'] == city_code].empty
-
-def process_single_image(args):
-    city_code, image_dir = args
-    image_path = os.path.join(image_dir, f"pix__{city_code}__topology.png")
-    
-    if not os.path.exists(image_path):
-        return city_code, None, "error"
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            extracted_data = process_image(image_path)
-            return city_code, extracted_data, "success"
-        except Exception as e:
-            if attempt == MAX_RETRIES - 1:
-                return city_code, None, f"error: {str(e)}"
-            time.sleep(RETRY_DELAY)
-
-def main():
-    input_csv_path = "output/ix-br_slugs_data.csv"
-    output_csv_path = "output/ix-br_topologymaps_data.csv"
-    image_dir = "output/img/topologymaps"
-
-    if os.path.exists(output_csv_path):
-        logging.info(f"Output CSV file already exists. Reading from {output_csv_path}")
-        df = pd.read_csv(output_csv_path)
-    else:
-        logging.info(f"Output CSV file does not exist. Creating new DataFrame")
-        df = pd.DataFrame(columns=['Sigla da Cidade', 'PIX-A', 'Download_valor', 'Download_porcentagem',
-                                   'Upload_valor', 'Upload_porcentagem', 'PIX-B', 'Extraction_Date'])
-
-    input_df = pd.read_csv(input_csv_path)
-    city_codes = input_df['Sigla da Cidade'].unique()
-
-    total_images = len(city_codes)
-    logging.info(f"Starting processing of {total_images} images...")
-
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_single_image, (city_code, image_dir)) for city_code in city_codes]
-        
-        processed_images = 0
-        skipped_images = 0
-        errors = 0
-        
-        for future in tqdm(as_completed(futures), total=total_images, desc="Processing Images"):
-            city_code, extracted_data, status = future.result()
-            if status == "success":
-                df = update_csv(df, extracted_data, city_code)
-                processed_images += 1
-            elif status == "skipped":
                 skipped_images += 1
-            else:
-                errors += 1
-            
-            if processed_images % 10 == 0:
-                df.to_csv(output_csv_path, index=False)
-                logging.info(f"CSV file saved. Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
-
-    df.to_csv(output_csv_path, index=False)
-    logging.info(f"Processing complete. Total images: {total_images}, Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
-    logging.info(f"CSV file updated: {output_csv_path}")
-
-if __name__ == "__main__":
-    main()
-import os
-import csv
-from datetime import date
-import base64
-from dotenv import load_dotenv
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-import pandas as pd
-import time
-import logging
-from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Get API key from environment variable
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("No OpenAI API key found. Please check your .env file.")
-
-# Configuration
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
-MAX_WORKERS = 4  # Number of parallel processes
-
-# Initialize the ChatOpenAI model
-chat = ChatOpenAI(model="gpt-4-vision-preview", max_tokens=300)
-
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-def process_image(image_path):
-    base64_image = encode_image(image_path)
-    
-    messages = [
-        SystemMessage(content="You are an AI assistant that analyzes topology map images and extracts specific data from them."),
-        HumanMessage(content=[
-            {"type": "text", "text": "Extract the following data from this topology map image:\n"
-             "PIX-A: <name>\n"
-             "Download_valor: <value><unit>\n"
-             "Download_porcentagem: <percentage>%\n"
-             "Upload_valor: <value><unit>\n"
-             "Upload_porcentagem: <percentage>%\n"
-             "PIX-B: <name>\n"
-             "Where <name> is the name of the PIX, <value> is a number, <unit> is K, M, G, or T, and <percentage> is a number.\n"
-             "If percentage is not available in the image, use the value from the legend based on the arrow color.\n"
-             "If there are multiple connections, provide data for the one with the highest download value.\n"
-             "For 1-to-N or 1-to-'PIX Central' topologies, focus on the main connection.\n"
-             "Respond only with the extracted data in the exact format specified, nothing else."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
-        ])
-    ]
-    
-    response = chat(messages)
-    return response.content
-
-def update_csv(df, extracted_data, city_code):
-    lines = extracted_data.strip().split('\n')
-    data = {}
-    for line in lines:
-        key, value = line.split(': ')
-        data[key] = value
+        else:
+            errors += 1
     
-    update_data = {
-        'Sigla da Cidade': city_code,
-        'PIX-A': data['PIX-A'],
-        'Download_valor': data['Download_valor'],
-        'Download_porcentagem': data['Download_porcentagem'],
-        'Upload_valor': data['Upload_valor'],
-        'Upload_porcentagem': data['Upload_porcentagem'],
-        'PIX-B': data['PIX-B'],
-        'Extraction_Date': date.today().isoformat()
-    }
-    
-    df = df.append(update_data, ignore_index=True)
-    return df
-
-def is_row_processed(df, city_code):
-    return not df[df['Sigla da Cidade'] == city_code].empty
-
-def process_single_image(args):
-    city_code, image_dir = args
-    image_path = os.path.join(image_dir, f"pix__{city_code}__topology.png")
-    
-    if not os.path.exists(image_path):
-        return city_code, None, "error"
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            extracted_data = process_image(image_path)
-            return city_code, extracted_data, "success"
-        except Exception as e:
-            if attempt == MAX_RETRIES - 1:
-                return city_code, None, f"error: {str(e)}"
-            time.sleep(RETRY_DELAY)
+    df = apply_results(df, results, RESULT_KEY)
+    return df, processed_images, skipped_images, errors
 
 def main():
-    input_csv_path = "output/ix-br_slugs_data.csv"
-    output_csv_path = "output/ix-br_topologymaps_data.csv"
-    image_dir = "output/img/topologymaps"
-
-    if os.path.exists(output_csv_path):
-        logging.info(f"Output CSV file already exists. Reading from {output_csv_path}")
-        df = pd.read_csv(output_csv_path)
-    else:
-        logging.info(f"Output CSV file does not exist. Creating new DataFrame")
-        df = pd.DataFrame(columns=['Sigla da Cidade', 'PIX-A', 'Download_valor', 'Download_porcentagem',
-                                   'Upload_valor', 'Upload_porcentagem', 'PIX-B', 'Extraction_Date'])
-
-    input_df = pd.read_csv(input_csv_path)
-    city_codes = input_df['Sigla da Cidade'].unique()
-
-    total_images = len(city_codes)
-    logging.info(f"Starting processing of {total_images} images...")
-
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_single_image, (city_code, image_dir)) for city_code in city_codes]
-        
-        processed_images = 0
-        skipped_images = 0
-        errors = 0
-        
-        for future in tqdm(as_completed(futures), total=total_images, desc="Processing Images"):
-            city_code, extracted_data, status = future.result()
-            if status == "success":
-                df = update_csv(df, extracted_data, city_code)
-                processed_images += 1
-            elif status == "skipped":
-                skipped_images += 1
-            else:
-                errors += 1
-            
-            if processed_images % 10 == 0:
-                df.to_csv(output_csv_path, index=False)
-                logging.info(f"CSV file saved. Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
-
-    df.to_csv(output_csv_path, index=False)
-    logging.info(f"Processing complete. Total images: {total_images}, Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
-    logging.info(f"CSV file updated: {output_csv_path}")
-
-if __name__ == "__main__":
-    main()
-import os
-import csv
-from datetime import date
-import base64
-from dotenv import load_dotenv
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-import pandas as pd
-import time
-import logging
-from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Get API key from environment variable
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("No OpenAI API key found. Please check your .env file.")
-
-# Configuration
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
-MAX_WORKERS = 4  # Number of parallel processes
-
-# Initialize the ChatOpenAI model
-chat = ChatOpenAI(model="gpt-4-vision-preview", max_tokens=300)
-
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-def process_image(image_path):
-    base64_image = encode_image(image_path)
-    
-    messages = [
-        SystemMessage(content="You are an AI assistant that analyzes topology map images and extracts specific data from them."),
-        HumanMessage(content=[
-            {"type": "text", "text": "Extract the following data from this topology map image:\n"
-             "PIX-A: <name>\n"
-             "Download_valor: <value><unit>\n"
-             "Download_porcentagem: <percentage>%\n"
-             "Upload_valor: <value><unit>\n"
-             "Upload_porcentagem: <percentage>%\n"
-             "PIX-B: <name>\n"
-             "Where <name> is the name of the PIX, <value> is a number, <unit> is K, M, G, or T, and <percentage> is a number.\n"
-             "If percentage is not available in the image, use the value from the legend based on the arrow color.\n"
-             "If there are multiple connections, provide data for the one with the highest download value.\n"
-             "For 1-to-N or 1-to-'PIX Central' topologies, focus on the main connection.\n"
-             "Respond only with the extracted data in the exact format specified, nothing else."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
-        ])
-    ]
-    
-    response = chat(messages)
-    return response.content
-
-def update_csv(df, extracted_data, city_code):
-    lines = extracted_data.strip().split('\n')
-    data = {}
-    for line in lines:
-        key, value = line.split(': ')
-        data[key] = value
-    
-    update_data = {
-        'Sigla da Cidade': city_code,
-        'PIX-A': data['PIX-A'],
-        'Download_valor': data['Download_valor'],
-        'Download_porcentagem': data['Download_porcentagem'],
-        'Upload_valor': data['Upload_valor'],
-        'Upload_porcentagem': data['Upload_porcentagem'],
-        'PIX-B': data['PIX-B'],
-        'Extraction_Date': date.today().isoformat()
-    }
-    
-    df = df.append(update_data, ignore_index=True)
-    return df
-
-def is_row_processed(df, city_code):
-    return not df[df['Sigla da Cidade'] == city_code].empty
-
-def process_single_image(args):
-    city_code, image_dir = args
-    image_path = os.path.join(image_dir, f"pix__{city_code}__topology.png")
-    
-    if not os.path.exists(image_path):
-        return city_code, None, "error"
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            extracted_data = process_image(image_path)
-            return city_code, extracted_data, "success"
-        except Exception as e:
-            if attempt == MAX_RETRIES - 1:
-                return city_code, None, f"error: {str(e)}"
-            time.sleep(RETRY_DELAY)
-
-def main():
-    input_csv_path = "output/ix-br_slugs_data.csv"
-    output_csv_path = "output/ix-br_topologymaps_data.csv"
-    image_dir = "output/img/topologymaps"
+    input_table = "ix-br_slugs_data"
+    output_table = "ix-br_slugs_data_processed"
+    image_dir = "output/img/charts"
 
-    if os.path.exists(output_csv_path):
-        logging.info(f"Output CSV file already exists. Reading from {output_csv_path}")
-        df = pd.read_csv(output_csv_path)
+    if table_exists(output_table):
+        logging.info(f"Output table already exists. Reading from {output_table}")
+        df = read_table(output_table)
     else:
-        logging.info(f"Output CSV file does not exist. Creating new DataFrame")
-        df = pd.DataFrame(columns=['Sigla da Cidade', 'PIX-A', 'Download_valor', 'Download_porcentagem',
-                                   'Upload_valor', 'Upload_porcentagem', 'PIX-B', 'Extraction_Date'])
+        logging.info(f"Output table does not exist. Reading from {input_table}")
+        df = read_table(input_table)
+        for col in EXTRACTION_COLUMNS:
+            if col not in df.columns:
+                df[col] = pd.NA
 
-    input_df = pd.read_csv(input_csv_path)
-    city_codes = input_df['Sigla da Cidade'].unique()
+    # Results from an interrupted run are replayed from the append-only log instead of re-extracted
+    log_path = result_log_path(output_table)
+    replayed = replay_log(log_path)
+    if replayed:
+        logging.info(f"Replaying {len(replayed)} results from {log_path}")
+        df = apply_results(df, replayed, RESULT_KEY)
 
-    total_images = len(city_codes)
+    total_images = len(df)
     logging.info(f"Starting processing of {total_images} images...")
 
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_single_image, (city_code, image_dir)) for city_code in city_codes]
-        
-        processed_images = 0
-        skipped_images = 0
-        errors = 0
-        
-        for future in tqdm(as_completed(futures), total=total_images, desc="Processing Images"):
-            city_code, extracted_data, status = future.result()
-            if status == "success":
-                df = update_csv(df, extracted_data, city_code)
-                processed_images += 1
-            elif status == "skipped":
-                skipped_images += 1
-            else:
-                errors += 1
-            
-            if processed_images % 10 == 0:
-                df.to_csv(output_csv_path, index=False)
-                logging.info(f"CSV file saved. Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
+    with ResultLog(log_path) as result_log:
+        df, processed_images, skipped_images, errors = asyncio.run(process_images(df, image_dir, result_log, replayed))
 
-    df.to_csv(output_csv_path, index=False)
+    compact(df, output_table, log_path)
+    # Charts fetched since the last run are appended to the partitioned history store
+    append_snapshot(df)
     logging.info(f"Processing complete. Total images: {total_images}, Processed: {processed_images}, Skipped: {skipped_images}, Errors: {errors}")
-    logging.info(f"CSV file updated: {output_csv_path}")
+    logging.info(f"Table updated: {output_table}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,77 @@
+import os
+import sys
+
+import numpy as np
+
+from convert_to_mbps import normalize_charts
+from matcher import match_names, normalize_name
+from storage import read_table, write_table
+
+# Utilização das portas: cruza o pico de tráfego extraído dos gráficos do ix.br (script 5)
+# com a velocidade das portas no PeeringDB (netixlan.speed) para cada participante.
+HOT_THRESHOLD = float(os.getenv("HOT_THRESHOLD", "0.8"))  # Fração da capacidade a partir da qual a porta é sinalizada
+REPORT_LIMIT = 20
+
+def load_participants():
+    df = normalize_charts(read_table('ix-br_slugs_data_processed'))
+    df['peak_mbps'] = df[['Input_Maximum', 'Output_Maximum']].max(axis=1)
+    return df[['Sigla da Cidade', 'Nome da Cidade', 'UF do Estado', 'Slug', 'Nome longo Empresa', 'peak_mbps']]
+
+def load_networks():
+    networks = read_table('peeringdb_net_data', columns=['id', 'name', 'asn', 'aka'])
+    return networks.rename(columns={'id': 'net_id', 'name': 'net_name', 'asn': 'net_asn'}).drop_duplicates('net_id')
+
+def match_participants(participants, networks):
+    # Casamento aproximado e indexado (matcher.py) entre 'Nome longo Empresa' e name/aka do PeeringDB
+    matches = match_names(participants['Nome longo Empresa'], networks)
+    participants = participants.join(matches)
+    return participants.merge(networks[['net_id', 'net_name', 'net_asn']], on='net_id', how='left')
+
+def port_capacity():
+    # Capacidade por (rede, cidade do IX): soma das portas da rede em todos os IXs da cidade
+    ports = read_table('peeringdb_fact_netixlan', columns=['net_id', 'ix_id', 'speed'])
+    ixs = read_table('peeringdb_dim_ix', columns=['ix_id', 'ix_city'])
+    ports = ports.merge(ixs, on='ix_id', how='inner')
+    ports['city_key'] = normalize_name(ports['ix_city'])
+    return ports.groupby(['net_id', 'city_key'], as_index=False)['speed'].sum().rename(columns={'speed': 'port_mbps'})
+
+def compute_utilisation(participants, capacity, threshold=HOT_THRESHOLD):
+    ports = participants.assign(city_key=normalize_name(participants['Nome da Cidade']))
+    ports = ports.merge(capacity, on=['net_id', 'city_key'], how='left').drop(columns=['city_key'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ports['utilisation'] = ports['peak_mbps'] / ports['port_mbps'].where(ports['port_mbps'] > 0)
+    ports['hot'] = ports['utilisation'] >= threshold
+    return ports.sort_values('utilisation', ascending=False, na_position='last').reset_index(drop=True)
+
+def rank_cities(ports):
+    # Folga por cidade: capacidade contratada menos pico observado, só para portas com os dois lados conhecidos
+    known = ports.dropna(subset=['utilisation'])
+    cities = known.groupby(['Sigla da Cidade', 'Nome da Cidade', 'UF do Estado'], as_index=False).agg(
+        ports=('Slug', 'count'),
+        hot_ports=('hot', 'sum'),
+        port_mbps=('port_mbps', 'sum'),
+        peak_mbps=('peak_mbps', 'sum'),
+    )
+    cities['headroom_mbps'] = cities['port_mbps'] - cities['peak_mbps']
+    cities['headroom_ratio'] = cities['headroom_mbps'] / cities['port_mbps']
+    return cities.sort_values('headroom_ratio').reset_index(drop=True)
+
+def build_report(threshold=HOT_THRESHOLD):
+    participants = load_participants()
+    networks = load_networks()
+    matched = match_participants(participants, networks)
+    ports = compute_utilisation(matched, port_capacity(), threshold)
+    cities = rank_cities(ports)
+    write_table(ports, 'utilisation_ports')
+    write_table(cities, 'utilisation_cities')
+
+    print(f"Participantes casados com o PeeringDB: {matched['net_id'].notna().sum()} de {len(matched)}")
+    print(f"Portas acima de {threshold:.0%} da capacidade: {int(ports['hot'].sum())}")
+    columns = ['Sigla da Cidade', 'Slug', 'net_name', 'match_score', 'peak_mbps', 'port_mbps', 'utilisation']
+    print(ports[ports['hot']][columns].head(REPORT_LIMIT).to_string(index=False))
+    print("\nCidades com menor folga:")
+    print(cities.head(REPORT_LIMIT).to_string(index=False))
+    return ports, cities
+
+if __name__ == "__main__":
+    build_report(float(sys.argv[1]) if len(sys.argv) > 1 else HOT_THRESHOLD)
@@ -0,0 +1,90 @@
+import glob
+import gzip
+import json
+import os
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+import html_parser
+import http_replay
+
+# Micro-benchmark do parsing das páginas do ix.br: o caminho antigo (BeautifulSoup + find)
+# contra html_parser em cada backend disponível. As páginas vêm de fixtures/html e das respostas
+# HTML gravadas por http_replay (HTTP_REPLAY_MODE=record); sem nenhuma, usa uma página sintética.
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'html')
+REPEAT = 20
+GRAPH_TYPES = ['Daily', 'Weekly', 'Monthly', 'Yearly', 'Decadely']  # Os mesmos períodos do script 4
+SYNTHETIC_PARTICIPANTS = 300
+
+def legacy_parse(html):
+    # O que os scripts 2, 3, 4 e 6 faziam antes: um BeautifulSoup completo por consulta
+    select = BeautifulSoup(html, 'html.parser').find('select')
+    options = [(o.get('value') or '', o.text.strip()) for o in select.find_all('option')] if select else None
+    map_tag = BeautifulSoup(html, 'html.parser').find('map')
+    areas = [dict(area.attrs) for area in map_tag.find_all('area')] if map_tag else None
+    soup = BeautifulSoup(html, 'html.parser')
+    srcs = {img['alt']: img['src'] for img in soup.find_all('img', alt=GRAPH_TYPES) if img.get('src')}
+    img = BeautifulSoup(html, 'html.parser').find('img', attrs={'usemap': '#map'})
+    return options, areas, srcs, img['src'] if img else None
+
+def fast_parse(html):
+    return (html_parser.select_options(html), html_parser.map_areas(html),
+            html_parser.img_srcs(html, GRAPH_TYPES), html_parser.img_src(html, 'img[usemap="#map"]'))
+
+def load_fixtures(fixtures_dir=FIXTURES_DIR):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, '*.html'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+def load_recorded_pages():
+    # Páginas HTML do arquivo de gravações do http_replay, identificadas pela URL original
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(http_replay.FIXTURES_DIR, 'requests', '*', '*.json.gz'))):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            entry = json.load(f)
+        if 'html' not in entry.get('headers', {}).get('Content-Type', ''):
+            continue
+        body = http_replay.load_blob(entry['body_sha256'])
+        if body is not None:
+            pages[entry['url']] = body.decode('utf-8', errors='replace')
+    return pages
+
+def synthetic_page(participants=SYNTHETIC_PARTICIPANTS):
+    # Mesma estrutura das páginas de cidade: <select id="router">, imagem com <map> de participantes
+    # e as imagens dos gráficos por período
+    options = ''.join(f'<option value="/trafego/pix/c{i}">Cidade {i}/UF</option>' for i in range(40))
+    areas = ''.join(f'<area shape="rect" alt="AS{i}" href="/trafego/pix/sp/as{i}/bps" title="Rede {i} Ltda" '
+                    f'coords="{i},0,{i + 10},10">' for i in range(participants))
+    charts = ''.join(f'<img alt="{graph_type}" src="/img/{graph_type.lower()}.png">' for graph_type in GRAPH_TYPES)
+    return (f'<html><head><script>var x = 1;</script></head><body><select id="router">'
+            f'<option value="">Selecione</option>{options}</select><img usemap="#map" src="/img/map.png">'
+            f'<map name="map">{areas}</map>{charts}</body></html>')
+
+def benchmark(pages, repeat=REPEAT):
+    backends = ['bs4'] + (['selectolax'] if html_parser.HTMLParser is not None else [])
+    print(f"{'página':40} {'legado':>10} " + ' '.join(f"{backend:>12}" for backend in backends))
+    for name, html in pages.items():
+        expected = legacy_parse(html)
+        legacy = timeit.timeit(lambda: legacy_parse(html), number=repeat) / repeat
+        timings = []
+        for backend in backends:
+            html_parser.HTML_BACKEND = backend
+            # Mesmo resultado do caminho antigo antes de comparar tempos
+            if fast_parse(html) != expected:
+                print(f"{name}: resultado diferente do legado com o backend {backend}")
+            timings.append(timeit.timeit(lambda: fast_parse(html), number=repeat) / repeat)
+        print(f"{name:40} {legacy * 1000:8.2f}ms " + ' '.join(
+            f"{t * 1000:8.2f}ms{legacy / t:>3.0f}x" if t else f"{'-':>12}" for t in timings))
+
+if __name__ == "__main__":
+    fixtures_dir = sys.argv[1] if len(sys.argv) > 1 else FIXTURES_DIR
+    pages = {**load_fixtures(fixtures_dir), **load_recorded_pages()}
+    if not pages:
+        print(f"Nenhuma página em {fixtures_dir} nem em {http_replay.FIXTURES_DIR}; usando uma página sintética. "
+              "Para medir páginas reais, rode o pipeline com HTTP_REPLAY_MODE=record.")
+        pages = {'sintética': synthetic_page()}
+    benchmark(pages)
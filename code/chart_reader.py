@@ -0,0 +1,382 @@
+import hashlib
+import os
+import re
+import sys
+
+import numpy as np
+from PIL import Image
+
+from storage import read_table
+
+# Leitor determinístico dos gráficos MRTG/RRD do ix.br: lê a legenda comparando glifos
+# com modelos aprendidos e recupera a série plotada varrendo as cores coluna a coluna.
+
+GLYPHS_FILE = "glyphs/chart_glyphs.npz"
+TEXT_THRESHOLD = 110  # Pixels com todos os canais abaixo disso são texto (exclui as cores das séries)
+SPACE_GAP = 3  # Colunas vazias que separam palavras
+GLYPH_MAX_MISMATCH = 0.08  # Fração de pixels divergentes aceita no casamento aproximado
+
+# Caixas (x0, y0, x1, y1) em pixels. None = detecção automática
+LEGEND_BOX = None
+Y_LABEL_BOX = None
+PLOT_BOX = None
+
+INPUT_COLOR = (0, 204, 0)  # Área verde do tráfego de entrada
+OUTPUT_COLOR = (0, 0, 255)  # Linha azul do tráfego de saída
+COLOR_TOLERANCE = 60
+AXIS_THRESHOLD = TEXT_THRESHOLD  # Eixos e moldura são traços escuros contínuos, como o texto
+MIN_AXIS_LENGTH = 0.4  # Fração da largura/altura da imagem para um traço contar como eixo
+GRID_MIN_SPAN = 0.8  # Fração da largura entre os eixos que uma linha de grade deve cobrir
+
+SI_FACTORS = {'': 1, 'k': 1e3, 'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+# Valores só contam quando a palavra inteira foi reconhecida (sem glifos '?')
+VALUE_UNIT_PATTERN = re.compile(r'(?<!\S)(\d+(?:[.,]\d+)?)\s*([kKMGT]?bps)(?!\S)')
+AXIS_LABEL_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)([kKMGT]?)')
+
+def load_image(image_path):
+    with Image.open(image_path) as img:
+        return np.asarray(img.convert('RGB'))
+
+def crop(array, box):
+    if box is None:
+        return array, 0, 0
+    x0, y0, x1, y1 = box
+    return array[y0:y1, x0:x1], x0, y0
+
+def text_mask(rgb):
+    return rgb.max(axis=2) < TEXT_THRESHOLD
+
+def color_mask(rgb, color, tolerance=COLOR_TOLERANCE):
+    distance = np.abs(rgb.astype(np.int16) - np.array(color, dtype=np.int16)).sum(axis=2)
+    return distance <= tolerance
+
+def runs(flags):
+    # Intervalos [início, fim) onde flags é verdadeiro
+    padded = np.concatenate(([False], flags, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return list(zip(edges[::2], edges[1::2]))
+
+def find_text_lines(mask):
+    return runs(mask.any(axis=1))
+
+def segment_words(line_mask):
+    glyph_spans = runs(line_mask.any(axis=0))
+    words = []
+    for span in glyph_spans:
+        if words and span[0] - words[-1][-1][1] <= SPACE_GAP:
+            words[-1].append(span)
+        else:
+            words.append([span])
+    return words
+
+def glyph_bitmap(line_mask, x0, x1):
+    # Recorte justo na tinta: o mesmo caractere tem o mesmo bitmap na legenda e no eixo
+    column = line_mask[:, x0:x1]
+    y0, y1 = runs(column.any(axis=1))[0][0], runs(column.any(axis=1))[-1][1]
+    return column[y0:y1]
+
+def glyph_key(bitmap):
+    return bitmap.shape, np.packbits(bitmap).tobytes()
+
+def load_glyphs(glyphs_file=GLYPHS_FILE):
+    if not os.path.exists(glyphs_file):
+        return {}
+    glyphs = {}
+    with np.load(glyphs_file) as data:
+        for name in data.files:
+            char = chr(int(name.split('_')[0]))
+            glyphs[glyph_key(data[name].astype(bool))] = (char, data[name].astype(bool))
+    return glyphs
+
+def reader_version(glyphs_file=GLYPHS_FILE):
+    # Muda quando o código do leitor ou os glifos mudam; invalida as leituras locais em cache
+    digest = hashlib.sha256()
+    for path in (os.path.abspath(__file__), glyphs_file):
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def save_glyphs(glyphs, glyphs_file=GLYPHS_FILE):
+    os.makedirs(os.path.dirname(glyphs_file) or '.', exist_ok=True)
+    arrays = {f"{ord(char)}_{i}": bitmap for i, (char, bitmap) in enumerate(glyphs.values())}
+    np.savez_compressed(glyphs_file, **arrays)
+
+def match_glyph(bitmap, glyphs):
+    exact = glyphs.get(glyph_key(bitmap))
+    if exact:
+        return exact[0]
+    best_char, best_score = None, GLYPH_MAX_MISMATCH
+    for char, template in glyphs.values():
+        if template.shape != bitmap.shape:
+            continue
+        score = np.count_nonzero(template != bitmap) / bitmap.size
+        if score <= best_score:
+            best_char, best_score = char, score
+    return best_char
+
+def read_line(line_mask, glyphs):
+    # Glifos desconhecidos (rótulos como "Maximum") viram '?'; só números e unidades precisam de modelo
+    words = []
+    for word in segment_words(line_mask):
+        chars = [match_glyph(glyph_bitmap(line_mask, x0, x1), glyphs) or '?' for x0, x1 in word]
+        words.append(''.join(chars))
+    return ' '.join(words)
+
+def read_text_lines(rgb, glyphs, box=None):
+    region, _, y_offset = crop(rgb, box)
+    mask = text_mask(region)
+    return [(y0 + y_offset, y1 + y_offset, read_line(mask[y0:y1], glyphs)) for y0, y1 in find_text_lines(mask)]
+
+def read_legend(rgb, glyphs):
+    # As duas primeiras linhas com três pares valor/unidade são Input e Output
+    legend_lines = []
+    for _, _, text in read_text_lines(rgb, glyphs, LEGEND_BOX):
+        pairs = VALUE_UNIT_PATTERN.findall(text)
+        if len(pairs) == 3:
+            legend_lines.append([(value.replace(',', '.'), unit) for value, unit in pairs])
+        if len(legend_lines) == 2:
+            return legend_lines
+    return None
+
+def axis_lines(mask, min_length):
+    # (posição, início, fim) do traço contínuo mais longo de cada linha da máscara que passa de min_length.
+    # Texto e grades pontilhadas não formam traços desse tamanho
+    lines = []
+    for position in np.flatnonzero(mask.sum(axis=1) >= min_length):
+        start, end = max(runs(mask[position]), key=lambda run: run[1] - run[0])
+        if end - start >= min_length:
+            lines.append((position, start, end))
+    return lines
+
+def find_plot_box(rgb):
+    # A área plotada é delimitada pelos eixos, não pelos pixels das séries (que incluem as amostras
+    # de cor da legenda): o eixo X (traço horizontal mais baixo) dá a base e a extensão do tempo,
+    # o eixo Y (traço vertical mais à esquerda) dá a borda esquerda e o topo. Uma moldura, quando
+    # existe, fecha a caixa por cima e pela direita
+    if PLOT_BOX is not None:
+        return PLOT_BOX
+    dark = rgb.max(axis=2) < AXIS_THRESHOLD
+    height, width = dark.shape
+    horizontal = axis_lines(dark, MIN_AXIS_LENGTH * width)
+    vertical = axis_lines(dark.T, MIN_AXIS_LENGTH * height)
+    if not horizontal or not vertical:
+        return None
+    # Traços com mais de um pixel de espessura aparecem como linhas vizinhas
+    rows = {y for y, _, _ in horizontal}
+    cols = {x for x, _, _ in vertical}
+    x_axis_y, x_start, x_end = horizontal[-1]
+    while x_axis_y - 1 in rows:
+        x_axis_y -= 1
+    y_axis_x, top, _ = vertical[0]
+    left = y_axis_x
+    while left + 1 in cols:
+        left += 1
+    frame_top = [y for y, start, end in horizontal if y < x_axis_y - 1 and start <= left + 1 and end >= x_end - 1]
+    if frame_top:
+        y = frame_top[0]
+        while y + 1 in rows:
+            y += 1
+        top = max(top, y + 1)
+    frame_right = [x for x in sorted(cols) if x > left + 1]
+    x0, x1 = max(left + 1, x_start), min([x_end] + frame_right[:1])
+    if not frame_top and not frame_right:
+        # Eixos sem moldura (MRTG) passam da área com as setas; a grade pontilhada marca o limite real
+        top, x1 = fit_to_grid(rgb, dark, (x0, top, x1, x_axis_y))
+    if x1 - x0 < 2 or x_axis_y - top < 2:
+        return None
+    return x0, top, x1, x_axis_y
+
+def fit_to_grid(rgb, dark, box):
+    # Linhas da grade: pixels que não são fundo, eixo/texto nem série, espalhados por quase toda a largura
+    x0, y0, x1, y1 = box
+    region = rgb[y0:y1, x0:x1]
+    background = np.median(region.reshape(-1, 3), axis=0)
+    grid = ((np.abs(region.astype(np.int16) - background).sum(axis=2) > COLOR_TOLERANCE)
+            & ~dark[y0:y1, x0:x1] & ~color_mask(region, INPUT_COLOR) & ~color_mask(region, OUTPUT_COLOR))
+    top, right = None, None
+    for row in range(grid.shape[0]):
+        cols = np.flatnonzero(grid[row])
+        if len(cols) and cols[-1] - cols[0] >= GRID_MIN_SPAN * (x1 - x0):
+            top = row if top is None else top
+            right = max(right or 0, cols[-1] + 1)
+    if top is None:
+        return y0, x1
+    return y0 + top, x0 + right
+
+def calibrate_y_axis(rgb, glyphs, plot_box):
+    # Ajusta valor = a * y + b a partir dos rótulos do eixo Y à esquerda da área plotada
+    box = Y_LABEL_BOX or (0, 0, plot_box[0], rgb.shape[0])
+    points = []
+    for y0, y1, text in read_text_lines(rgb, glyphs, box):
+        # O rótulo inteiro precisa ser reconhecido: "1?0G" lido como 1 descalibraria o eixo
+        label = text.replace(' ', '')
+        match = AXIS_LABEL_PATTERN.fullmatch(label) if '?' not in label else None
+        if match:
+            value = float(match.group(1).replace(',', '.')) * SI_FACTORS[match.group(2)]
+            points.append(((y0 + y1 - 1) / 2, value))
+    if len(points) < 2:
+        return None
+    ys, values = np.array(points).T
+    slope, intercept = np.polyfit(ys, values, 1)
+    if slope >= 0:
+        return None
+    return slope, intercept
+
+def scan_series(rgb, color, plot_box, calibration):
+    # Para cada coluna, o pixel mais alto da cor da série define o valor (área ou linha)
+    x0, y0, x1, y1 = plot_box
+    mask = color_mask(rgb[y0:y1, x0:x1], color)
+    present = mask.any(axis=0)
+    top = np.argmax(mask, axis=0) + y0
+    slope, intercept = calibration
+    values = np.where(present, slope * top + intercept, np.nan)
+    return np.clip(values, 0, None).astype(np.float32)
+
+def read_series(rgb, glyphs):
+    plot_box = find_plot_box(rgb)
+    if plot_box is None:
+        return None
+    calibration = calibrate_y_axis(rgb, glyphs, plot_box)
+    if calibration is None:
+        return None
+    return {
+        'Input': scan_series(rgb, INPUT_COLOR, plot_box, calibration),
+        'Output': scan_series(rgb, OUTPUT_COLOR, plot_box, calibration),
+    }
+
+def format_bps(value):
+    for prefix in ['T', 'G', 'M', 'k']:
+        if value >= SI_FACTORS[prefix]:
+            return f"{value / SI_FACTORS[prefix]:.2f}", f"{prefix}bps"
+    return f"{value:.2f}", "bps"
+
+def summarize_series(values):
+    valid = values[~np.isnan(values)]
+    if valid.size == 0:
+        return None
+    return [format_bps(valid.max()), format_bps(valid.mean()), format_bps(valid[-1])]
+
+def format_extraction(legend_lines):
+    # Mesmo formato da resposta do modelo, consumido por parse_extraction
+    lines = []
+    for direction, ((max_v, max_u), (avg_v, avg_u), (cur_v, cur_u)) in zip(['Input', 'Output'], legend_lines):
+        lines.append(f"{direction} Maximum: {max_v} {max_u} Average: {avg_v} {avg_u} Current: {cur_v} {cur_u}")
+    return '\n'.join(lines)
+
+def read_chart(image_path, glyphs):
+    if not glyphs:
+        return None
+    rgb = load_image(image_path)
+    legend_lines = read_legend(rgb, glyphs)
+    if legend_lines is None:
+        series = read_series(rgb, glyphs)
+        if series is None:
+            return None
+        legend_lines = [summarize_series(series['Input']), summarize_series(series['Output'])]
+        if None in legend_lines:
+            return None
+    return format_extraction(legend_lines)
+
+def align_known_values(words, pairs):
+    # Localiza, em ordem, palavras com o mesmo número de glifos que cada valor e unidade conhecidos
+    positions = []
+    start = 0
+    for value, unit in pairs:
+        for i in range(start, len(words) - 1):
+            if len(words[i]) == len(value) and len(words[i + 1]) == len(unit):
+                positions.append((i, value, unit))
+                start = i + 2
+                break
+        else:
+            return None
+    return positions
+
+def learn_glyphs(table, image_dir, glyphs_file=GLYPHS_FILE):
+    # Aprende os glifos de dígitos e unidades a partir de linhas já extraídas pelo modelo.
+    # Roda como etapa do pipeline depois do script 5: na execução seguinte, os gráficos com
+    # glifos conhecidos são lidos localmente
+    df = read_table(table).dropna(subset=['Input_Maximum', 'Output_Maximum']).astype('string')
+    glyphs = load_glyphs(glyphs_file)
+    known = {key: char for key, (char, _) in glyphs.items()}
+    conflicts = set()
+    learned_images = 0
+    for _, row in df.iterrows():
+        image_path = os.path.join(image_dir, f"pix__{row['Sigla da Cidade']}__{row['Slug']}__bps__daily.png")
+        if not os.path.exists(image_path):
+            continue
+        expected = [[(row[f'{d}_{m}'], row[f'{d}_{m}_Unit']) for m in ['Maximum', 'Average', 'Current']]
+                    for d in ['Input', 'Output']]
+        mask = text_mask(crop(load_image(image_path), LEGEND_BOX)[0])
+        lines = [mask[y0:y1] for y0, y1 in find_text_lines(mask)]
+        candidates = []
+        for line_mask in lines:
+            words = segment_words(line_mask)
+            positions = align_known_values(words, expected[len(candidates)])
+            if positions:
+                candidates.append((line_mask, words, positions))
+            if len(candidates) == 2:
+                break
+        if len(candidates) < 2:
+            continue
+        for line_mask, words, positions in candidates:
+            for i, value, unit in positions:
+                for (x0, x1), char in zip(words[i] + words[i + 1], value + unit):
+                    bitmap = glyph_bitmap(line_mask, x0, x1)
+                    key = glyph_key(bitmap)
+                    if key in glyphs and glyphs[key][0] != char:
+                        conflicts.add(key)
+                    glyphs[key] = (char, bitmap.copy())
+        learned_images += 1
+    for key in conflicts:
+        glyphs.pop(key, None)
+    if {key: char for key, (char, _) in glyphs.items()} == known:
+        # Sem regravar o arquivo, a versão do leitor e as leituras locais em cache continuam válidas
+        print(f"Nenhum glifo novo em {learned_images} imagens: {glyphs_file}")
+        return
+    save_glyphs(glyphs, glyphs_file)
+    print(f"{len(glyphs)} glifos aprendidos de {learned_images} imagens ({len(conflicts)} descartados por conflito): {glyphs_file}")
+
+def synthetic_chart(frame=False):
+    # Gráfico no formato MRTG (eixos com seta) ou RRD (moldura fechada), com grade pontilhada,
+    # rótulos à esquerda e amostras de cor na legenda abaixo; devolve a imagem e a caixa esperada
+    rgb = np.full((200, 500, 3), 255, dtype=np.uint8)
+    x0, y0, x1, y1 = 62, 20, 470, 160
+    for y in range(y0, y1, 35):
+        rgb[y, x0:x1:4] = (255, 0, 0)
+        rgb[y, x1 - 1] = (255, 0, 0)
+    columns = np.arange(x0, x1 - 10)
+    tops = (y1 - 10 - 60 * (1 + np.sin(columns / 40))).astype(int)
+    for x, top in zip(columns, tops):
+        rgb[top:y1, x] = INPUT_COLOR
+        rgb[max(top - 15, y0), x] = OUTPUT_COLOR
+    rgb[y0 - 6:y1 + 1, x0 - 2:x0] = 0
+    rgb[y1:y1 + 1, x0 - 2:x1 + (0 if frame else 8)] = 0
+    if frame:
+        rgb[y0 - 1, x0 - 2:x1 + 1] = 0
+        rgb[y0 - 1:y1 + 1, x1] = 0
+    for y in range(y0, y1, 35):
+        rgb[y:y + 7, 20:45:3] = 0
+    rgb[180:188, 10:18] = INPUT_COLOR
+    rgb[180:188, 150:158] = OUTPUT_COLOR
+    return rgb, (x0, y0, x1, y1)
+
+def check_plot_box():
+    ok = True
+    for frame in (False, True):
+        rgb, expected = synthetic_chart(frame)
+        found = tuple(int(v) for v in find_plot_box(rgb) or ())
+        ok &= found == expected
+        print(f"{'RRD' if frame else 'MRTG'}: esperado {expected}, encontrado {found or None}")
+    return ok
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '--learn':
+        learn_glyphs(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 2 and sys.argv[1] == '--check':
+        sys.exit(0 if check_plot_box() else 1)
+    elif len(sys.argv) == 2:
+        print(read_chart(sys.argv[1], load_glyphs()))
+    else:
+        print("Uso: python chart_reader.py --learn <tabela_processada> <dir_imagens> | python chart_reader.py <imagem.png> "
+              "| python chart_reader.py --check")
@@ -0,0 +1,23 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Processamento concorrente das cidades do PIX (scripts 2 e 3). Cada cidade roda num worker;
+# o ritmo das requisições ao ix.br fica com o limite por host de http_client (no lugar do
+# time.sleep(1) fixo), e as linhas saem na ordem da lista de cidades, independentemente
+# de qual worker termina primeiro, para que o CSV seja determinístico.
+CITY_WORKERS = int(os.getenv("CITY_WORKERS", "8"))
+
+def process_cities(city_info, city_rows, write_rows, workers=CITY_WORKERS):
+    # city_rows(city_code, city_uf) -> linhas da cidade; write_rows(city_code, city_uf, linhas) roda na thread principal
+    def run(city):
+        city_code, city_uf = city
+        try:
+            return city_rows(city_code, city_uf)
+        except Exception as e:
+            print(f"Falha ao processar a cidade {city_code}. Erro: {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # map devolve os resultados na ordem de entrada, enquanto as cidades seguintes continuam rodando
+        for (city_code, city_uf), rows in zip(city_info, executor.map(run, city_info)):
+            write_rows(city_code, city_uf, rows)
@@ -1,57 +1,87 @@
-import csv
-import os
+import numpy as np
+import pandas as pd
 
-def convert_to_mbps(value, unit):
-    if not value or value == '':
-        return ''
+from storage import read_table, table_exists, write_csv_export, write_table
+
+# Fator para Mbps por unidade. Aceita a forma da legenda dos gráficos ('Gbps') e o sufixo
+# do mapa de topologia ('G'); unidade ausente ou desconhecida é tratada como Mbps
+UNIT_FACTORS = {
+    'bps': 1e-6, '': 1.0,
+    'k': 1e-3, 'K': 1e-3, 'kbps': 1e-3, 'Kbps': 1e-3,
+    'M': 1.0, 'Mbps': 1.0,
+    'G': 1e3, 'Gbps': 1e3,
+    'T': 1e6, 'Tbps': 1e6,
+}
+SUFFIXED_VALUE_PATTERN = r'^\s*(?P<value>\d+(?:[.,]\d+)?)\s*(?P<unit>[kKMGT]?(?:bps)?)\s*$'
+
+CHART_FIELDS = ['Input_Maximum', 'Input_Average', 'Input_Current',
+                'Output_Maximum', 'Output_Average', 'Output_Current']
+TOPOLOGY_VALUE_FIELDS = ['Download_valor', 'Upload_valor']
+TOPOLOGY_PERCENT_FIELDS = ['Download_porcentagem', 'Upload_porcentagem']
+
+def to_number(values):
     try:
-        value = float(value)
-        if unit == 'Gbps':
-            result = value * 1000
-        elif unit == 'Tbps':
-            result = value * 1000000
-        elif unit == 'Kbps':
-            result = value / 1000
-        else:  # Mbps ou desconhecido
-            result = value
-        return f"{result:.2f}".replace('.', ',')
-    except ValueError:
-        return ''  # Retorna uma string vazia se não puder converter
-
-def process_csv(input_file, output_file):
-    fields_to_convert = ['Input_Maximum', 'Input_Average', 'Input_Current',
-                         'Output_Maximum', 'Output_Average', 'Output_Current']
-
-    with open(input_file, 'r', newline='', encoding='utf-8') as infile, \
-         open(output_file, 'w', newline='', encoding='utf-8') as outfile:
-        
-        reader = csv.DictReader(infile)
-        fieldnames = [field for field in reader.fieldnames if not field.endswith('_Unit')]
-        
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-
-        for row in reader:
-            for field in fields_to_convert:
-                if field in row and f"{field}_Unit" in row:
-                    row[field] = convert_to_mbps(row[field], row[f"{field}_Unit"])
-            
-            # Remove os campos '_Unit'
-            row = {k: v for k, v in row.items() if not k.endswith('_Unit')}
-            writer.writerow(row)
-
-    print(f"Conversão concluída. Os valores foram convertidos para Mbps e as casas decimais foram formatadas com vírgula.")
+        # Caminho rápido: coluna toda com ponto decimal (ou já numérica) converte direto em C
+        return values.astype(np.float64)
+    except (TypeError, ValueError):
+        numbers = pd.to_numeric(values, errors='coerce').astype(np.float64)
+    # Só as células que falharam (vírgula decimal, espaços) passam pelas operações de string
+    retry = numbers.isna() & values.notna()
+    if retry.any():
+        fixed = values[retry].astype('string').str.strip().str.replace(',', '.', regex=False)
+        numbers[retry] = pd.to_numeric(fixed, errors='coerce').astype(np.float64)
+    return numbers
 
-def main():
-    input_file = 'output/ix-br_slugs_data_processed.csv'
-    output_file = 'output/ix-br_slugs_data_converted.csv'
+def unit_factors(units):
+    # Poucas unidades distintas: o lookup é feito uma vez por unidade e espalhado pelos códigos
+    codes, uniques = pd.factorize(units)
+    table = np.array([UNIT_FACTORS.get(str(unit).strip(), 1.0) for unit in uniques] + [1.0])
+    return table[codes]  # código -1 (unidade ausente) cai no último elemento, 1.0
+
+def to_mbps(values, units):
+    return to_number(values) * unit_factors(units)
 
-    if not os.path.exists(input_file):
-        print(f"Arquivo de entrada não encontrado: {input_file}")
-        return
+def split_suffixed(values):
+    # '1.5G', '800M', '2,3 Tbps' -> (valor, unidade)
+    parts = values.astype('string').str.extract(SUFFIXED_VALUE_PATTERN)
+    return parts['value'], parts['unit']
 
-    process_csv(input_file, output_file)
-    print(f"Conversão concluída. Arquivo de saída: {output_file}")
+def normalize_charts(df):
+    df = df.copy()
+    for field in CHART_FIELDS:
+        unit_field = f"{field}_Unit"
+        if field in df.columns:
+            units = df[unit_field] if unit_field in df.columns else pd.Series('', index=df.index)
+            df[field] = to_mbps(df[field], units)
+    return df.drop(columns=[col for col in df.columns if col.endswith('_Unit')])
+
+def normalize_topology(df):
+    df = df.copy()
+    for field in TOPOLOGY_VALUE_FIELDS:
+        if field in df.columns:
+            df[field] = to_mbps(*split_suffixed(df[field]))
+    for field in TOPOLOGY_PERCENT_FIELDS:
+        if field in df.columns:
+            df[field] = to_number(df[field].astype('string').str.rstrip('%'))
+    return df
+
+def convert_table(input_table, output_table, normalize):
+    df = normalize(read_table(input_table))
+    # Parquet com float64; o CSV exportado mantém o formato brasileiro com vírgula decimal
+    write_table(df, output_table, export_csv=False)
+    write_csv_export(df, output_table, decimal=',', float_format='%.2f')
+    print(f"Conversão concluída. {len(df)} linhas convertidas para Mbps: {output_table}")
+
+def main():
+    conversions = [
+        ('ix-br_slugs_data_processed', 'ix-br_slugs_data_converted', normalize_charts),
+        ('ix-br_topologymaps_data', 'ix-br_topologymaps_data_converted', normalize_topology),
+    ]
+    for input_table, output_table, normalize in conversions:
+        if not table_exists(input_table):
+            print(f"Tabela de entrada não encontrada: {input_table}")
+            continue
+        convert_table(input_table, output_table, normalize)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,122 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from chart_reader import load_glyphs, load_image, read_series
+from image_manifest import load_manifest
+from storage import OUTPUT_DIR, read_table
+
+# Digitaliza a curva completa dos gráficos (não só os números da legenda) e grava, por cidade e
+# período, um .npz com duas séries float32 em bps por slug e o horário da última coluna do gráfico.
+# Nenhuma chamada ao modelo é feita.
+IMAGE_DIR = os.path.join(OUTPUT_DIR, "img", "charts")
+SERIES_DIR = os.path.join(OUTPUT_DIR, "series")
+MAX_WORKERS = os.cpu_count() or 1
+CHART_TIMEZONE = ZoneInfo(os.getenv("CHART_TIMEZONE", "America/Sao_Paulo"))  # Horário dos gráficos do ix.br
+PERIOD_SECONDS = {
+    'daily': 24 * 3600,
+    'weekly': 7 * 24 * 3600,
+    'monthly': 31 * 24 * 3600,
+    'yearly': 365 * 24 * 3600,
+    'decadely': 10 * 365 * 24 * 3600,
+}
+
+def chart_path(image_dir, city_code, slug, period):
+    # Mesmo nome gerado por chart_filename no script 4
+    return os.path.join(image_dir, f"pix__{city_code.lower()}__{slug}__bps__{period}.png")
+
+def series_path(city_code, period):
+    return os.path.join(SERIES_DIR, period, f"{city_code.lower()}.npz")
+
+def chart_end_time(image_path, manifest):
+    # Os gráficos do ix.br terminam no momento em que foram gerados: Last-Modified da resposta
+    # quando o servidor o envia, senão o horário em que o arquivo foi baixado
+    last_modified = manifest.get(os.path.basename(image_path), {}).get('last_modified')
+    if last_modified:
+        try:
+            return parsedate_to_datetime(last_modified).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return os.path.getmtime(image_path)
+
+def digitize_chart(image_path, glyphs):
+    # Retorna (input, output) em bps, uma amostra por coluna da área plotada; NaN onde não há curva
+    series = read_series(load_image(image_path), glyphs)
+    if series is None:
+        return None
+    return series['Input'], series['Output']
+
+def sample_seconds(values, period):
+    return PERIOD_SECONDS[period] / len(values)
+
+def percentile_95(values):
+    # Cobrança pelo 95º percentil: descarta os 5% de amostras mais altas
+    return float(np.nanpercentile(values, 95)) if np.isfinite(values).any() else np.nan
+
+def sample_hours(values, end_time, period='daily'):
+    # Hora local de cada coluna: a última coluna é end_time e as anteriores recuam um passo cada
+    step = sample_seconds(values, period)
+    timestamps = end_time - step * np.arange(len(values) - 1, -1, -1)
+    offset = datetime.fromtimestamp(end_time, CHART_TIMEZONE).utcoffset().total_seconds()
+    return ((timestamps + offset) // 3600 % 24).astype(np.int64)
+
+def hourly_profile(values, end_time):
+    # Média por hora do relógio para um gráfico diário, que cobre as 24h anteriores a end_time
+    hours = sample_hours(values, end_time)
+    valid = np.isfinite(values)
+    totals = np.bincount(hours[valid], weights=values[valid], minlength=24)
+    counts = np.bincount(hours[valid], minlength=24)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (totals / counts).astype(np.float32)
+
+def peak_hour(values, end_time):
+    profile = hourly_profile(values, end_time)
+    return int(np.nanargmax(profile)) if np.isfinite(profile).any() else None
+
+def digitize_city(city_code, slugs, period, image_dir=IMAGE_DIR):
+    # Um processo por cidade: os glifos são carregados uma vez e todas as curvas vão para um único .npz
+    glyphs = load_glyphs()
+    manifest = load_manifest(image_dir)
+    arrays = {}
+    for slug in slugs:
+        image_path = chart_path(image_dir, city_code, slug, period)
+        if not os.path.exists(image_path):
+            continue
+        series = digitize_chart(image_path, glyphs)
+        if series is None:
+            continue
+        arrays[f"{slug}__input"], arrays[f"{slug}__output"] = series
+        arrays[f"{slug}__end"] = np.float64(chart_end_time(image_path, manifest))
+    if arrays:
+        path = series_path(city_code, period)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, **arrays)
+    return city_code, len(arrays) // 3, len(slugs)
+
+def load_city_series(city_code, period):
+    # {slug: (input, output, end_time)}, com end_time em segundos desde a época
+    with np.load(series_path(city_code, period)) as data:
+        slugs = sorted({name.rsplit('__', 1)[0] for name in data.files})
+        return {slug: (data[f"{slug}__input"], data[f"{slug}__output"], float(data[f"{slug}__end"])) for slug in slugs}
+
+def digitize_all(period='daily', image_dir=IMAGE_DIR, max_workers=MAX_WORKERS):
+    df = read_table('ix-br_slugs_data', columns=['Sigla da Cidade', 'Slug']).dropna().drop_duplicates()
+    cities = df.groupby('Sigla da Cidade')['Slug'].apply(list)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(digitize_city, city_code, slugs, period, image_dir)
+                   for city_code, slugs in cities.items()]
+        for future in futures:
+            city_code, digitized, total = future.result()
+            print(f"{city_code}: {digitized} de {total} curvas digitalizadas ({period})")
+
+if __name__ == "__main__":
+    period = sys.argv[1].lower() if len(sys.argv) > 1 else 'daily'
+    if period not in PERIOD_SECONDS:
+        print(f"Uso: python curve_digitizer.py [{'|'.join(PERIOD_SECONDS)}]")
+    else:
+        digitize_all(period)
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+CACHE_FILE = "output/.extraction_cache.sqlite"
+CACHE_MAX_BYTES = 256 * 1024 * 1024  # Acima disso, as entradas usadas há mais tempo são removidas
+
+_connection = None
+
+def get_connection(cache_file=CACHE_FILE):
+    # Uma conexão por processo; o WAL permite que vários workers leiam e gravem ao mesmo tempo
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        _connection = sqlite3.connect(cache_file, timeout=30)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        _connection.execute("CREATE INDEX IF NOT EXISTS extractions_last_used ON extractions (last_used)")
+        _connection.commit()
+    return _connection
+
+def extraction_key(image_bytes, prompt, model):
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    prompt_hash = hashlib.sha256(f"{model}\n{prompt}".encode('utf-8')).hexdigest()
+    return f"{image_hash}:{prompt_hash}"
+
+def image_key(image_path, prompt, model):
+    with open(image_path, "rb") as image_file:
+        return extraction_key(image_file.read(), prompt, model)
+
+def get_cached(key):
+    conn = get_connection()
+    row = conn.execute("SELECT result FROM extractions WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("UPDATE extractions SET last_used = ? WHERE key = ?", (time.time(), key))
+    conn.commit()
+    return row[0]
+
+def put_cached(key, result, max_bytes=CACHE_MAX_BYTES):
+    conn = get_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO extractions (key, result, size, last_used) VALUES (?, ?, ?, ?)",
+        (key, result, len(key) + len(result.encode('utf-8')), time.time()),
+    )
+    evict(conn, max_bytes)
+    conn.commit()
+
+def evict(conn, max_bytes):
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+    if total <= max_bytes:
+        return
+    # Remove até 90% do limite para não repetir a varredura a cada nova entrada
+    target = max_bytes * 0.9
+    removed = 0
+    for key, size in conn.execute("SELECT key, size FROM extractions ORDER BY last_used").fetchall():
+        if total - removed <= target:
+            break
+        conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+        removed += size
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+
+import pandas as pd
+
+from storage import OUTPUT_DIR, write_table
+
+RESULT_LOG_SUFFIX = ".log.jsonl"
+LOG_FSYNC_EVERY = 50  # Resultados acumulados antes de forçar a gravação em disco
+LOG_FSYNC_INTERVAL = 5  # seconds; limite de tempo para um resultado ficar só no buffer
+
+def apply_results(df, results, key_columns):
+    # Aplica todos os resultados acumulados numa única passada vetorizada, em vez de uma máscara por imagem.
+    # Com várias colunas de chave, os resultados são indexados por tuplas na mesma ordem das colunas
+    if not results:
+        return df
+    updates = pd.DataFrame.from_dict(results, orient='index')
+    if isinstance(key_columns, str):
+        row_keys = pd.Index(df[key_columns])
+    else:
+        row_keys = pd.MultiIndex.from_frame(df[list(key_columns)])
+        updates.index = pd.MultiIndex.from_tuples(updates.index)
+    mask = row_keys.isin(updates.index)
+    aligned = updates.reindex(row_keys[mask])
+    for col in updates.columns:
+        if col in df.columns and df[col].dtype != object:
+            df[col] = df[col].astype(object)
+    df.loc[mask, updates.columns] = aligned.to_numpy()
+    return df
+
+def result_log_path(table):
+    return os.path.join(OUTPUT_DIR, f"{table}{RESULT_LOG_SUFFIX}")
+
+def replay_log(log_path):
+    # Reconstrói os resultados de uma execução interrompida; a última entrada vence
+    results = {}
+    if not os.path.exists(log_path):
+        return results
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Linha truncada por uma queda no meio da gravação
+                continue
+            # Chaves compostas são gravadas como listas JSON
+            key = entry['key']
+            results[tuple(key) if isinstance(key, list) else key] = entry['result']
+    return results
+
+def discard_partial_line(log_path):
+    # Remove o final sem '\n' deixado por uma queda, para que a próxima entrada comece numa linha nova
+    if not os.path.exists(log_path):
+        return
+    with open(log_path, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
+
+class ResultLog:
+    # Log append-only: cada resultado custa uma linha, e o fsync é feito em lotes
+    def __init__(self, log_path, fsync_every=LOG_FSYNC_EVERY, fsync_interval=LOG_FSYNC_INTERVAL):
+        self.log_path = log_path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.pending = 0
+        self.synced_at = time.monotonic()
+        os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+        discard_partial_line(log_path)
+        self.file = open(log_path, 'a', encoding='utf-8')
+
+    def append(self, key, result):
+        self.file.write(json.dumps({'key': key, 'result': result}, ensure_ascii=False) + '\n')
+        self.pending += 1
+        if self.pending >= self.fsync_every or time.monotonic() - self.synced_at >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def compact(df, table, log_path):
+    # Grava a tabela completa uma única vez e só então descarta o log já incorporado
+    write_table(df, table)
+    if os.path.exists(log_path):
+        os.remove(log_path)
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+# Limites padrão da conta OpenAI; ajuste conforme o tier
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200000
+ESTIMATED_TOKENS_PER_REQUEST = 1200  # Prompt + imagem + max_tokens da resposta
+INITIAL_CONCURRENCY = 16
+MAX_CONCURRENCY = 256
+MAX_RETRIES = 3
+RETRY_DELAY = 5  # seconds
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                await asyncio.sleep((amount - self.available) / self.rate)
+
+def is_rate_limit_error(error):
+    status = getattr(error, 'status_code', None) or getattr(error, 'http_status', None)
+    return status == 429 or 'RateLimit' in type(error).__name__
+
+class ExtractionScheduler:
+    # Concorrência adaptativa (AIMD): cresce um slot a cada janela sem erro e cai pela metade em um 429
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 initial_concurrency=INITIAL_CONCURRENCY, max_concurrency=MAX_CONCURRENCY,
+                 retries=MAX_RETRIES, retry_delay=RETRY_DELAY):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.limit = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.in_flight = 0
+        self.successes = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire_slot(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release_slot(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.max_concurrency:
+            self.limit += 1
+            self.successes = 0
+
+    def on_rate_limited(self):
+        self.limit = max(1, self.limit // 2)
+        self.successes = 0
+        logging.warning(f"Rate limit reached. Reducing concurrency to {self.limit}")
+
+    async def call(self, make_request, estimated_tokens=ESTIMATED_TOKENS_PER_REQUEST):
+        for attempt in range(self.retries):
+            await self.requests.acquire()
+            await self.tokens.acquire(estimated_tokens)
+            await self.acquire_slot()
+            try:
+                result = await make_request()
+                error = None
+            except Exception as e:
+                error = e
+            finally:
+                await self.release_slot()
+
+            if error is None:
+                self.on_success()
+                return result
+            if attempt == self.retries - 1:
+                raise error
+            # O slot já foi liberado: o backoff não ocupa capacidade de outras extrações
+            if is_rate_limit_error(error):
+                self.on_rate_limited()
+                await asyncio.sleep(self.retry_delay * (2 ** attempt))
+            else:
+                await asyncio.sleep(self.retry_delay)
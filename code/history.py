@@ -0,0 +1,131 @@
+import os
+import sqlite3
+
+import pandas as pd
+
+from convert_to_mbps import normalize_charts
+from storage import OUTPUT_DIR, pq, use_parquet
+
+# Histórico diário dos gráficos: um arquivo por (data, cidade) em layout particionado
+# date=AAAA-MM-DD/city=XXX/, mais um índice SQLite em (cidade, slug, data) que aponta as partições.
+# Uma consulta de um participante num intervalo lê só os arquivos daquele intervalo.
+HISTORY_DIR = os.path.join(OUTPUT_DIR, "history", "charts")
+INDEX_FILE = os.path.join(HISTORY_DIR, "_index.sqlite")
+COMPRESSION = "zstd"
+SNAPSHOT_COLUMNS = ['Sigla da Cidade', 'Slug', 'Input_Maximum', 'Input_Average', 'Input_Current',
+                    'Output_Maximum', 'Output_Average', 'Output_Current', 'Extraction_Date']
+
+def partition_file(snapshot_date, city_code):
+    ext = "parquet" if use_parquet() else "csv.gz"
+    return os.path.join(HISTORY_DIR, f"date={snapshot_date}", f"city={city_code}", f"part.{ext}")
+
+def get_index():
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    conn = sqlite3.connect(INDEX_FILE)
+    # Um mesmo participante pode estar em várias cidades do PIX: a cidade faz parte da chave
+    pk_columns = [row[1] for row in sorted(conn.execute("PRAGMA table_info(snapshots)"), key=lambda row: row[5]) if row[5]]
+    if pk_columns and pk_columns != ['city', 'slug', 'date']:
+        with conn:
+            conn.execute("ALTER TABLE snapshots RENAME TO snapshots_old")
+            create_index_table(conn)
+            conn.execute("INSERT OR REPLACE INTO snapshots (city, slug, date, path) "
+                         "SELECT city, slug, date, path FROM snapshots_old")
+            conn.execute("DROP TABLE snapshots_old")
+    create_index_table(conn)
+    return conn
+
+def create_index_table(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS snapshots ("
+        "city TEXT NOT NULL, slug TEXT NOT NULL, date TEXT NOT NULL, path TEXT NOT NULL, "
+        "PRIMARY KEY (city, slug, date))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS snapshots_slug_date ON snapshots (slug, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS snapshots_date ON snapshots (date)")
+
+def write_partition(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.part"
+    if path.endswith(".parquet"):
+        df.to_parquet(tmp_path, engine='pyarrow', index=False, compression=COMPRESSION)
+    else:
+        df.to_csv(tmp_path, index=False, compression='gzip')
+    os.replace(tmp_path, path)
+
+def read_partition(path, slug=None):
+    if path.endswith(".parquet"):
+        filters = [('Slug', '=', slug)] if slug else None
+        return pq.read_table(path, filters=filters, memory_map=True).to_pandas()
+    df = pd.read_csv(path, compression='gzip', dtype={'Sigla da Cidade': 'string', 'Slug': 'string'})
+    return df[df['Slug'] == slug] if slug else df
+
+def recorded_keys(conn, dates):
+    placeholders = ','.join('?' * len(dates))
+    return set(conn.execute(f"SELECT city, slug, date FROM snapshots WHERE date IN ({placeholders})", dates))
+
+def append_snapshot(df, snapshot_date=None):
+    # Cada gráfico entra na data em que a imagem foi baixada (Extraction_Date). Uma imagem que não
+    # mudou mantém a data já registrada e não vira um novo ponto da série; snapshot_date restringe a um dia
+    snapshot = normalize_charts(df[[col for col in df.columns if col in SNAPSHOT_COLUMNS or col.endswith('_Unit')]])
+    snapshot = snapshot.dropna(subset=['Input_Maximum', 'Output_Maximum'], how='all')
+    snapshot = snapshot.dropna(subset=['Extraction_Date'])
+    snapshot['Extraction_Date'] = snapshot['Extraction_Date'].astype('string')
+    if snapshot_date is not None:
+        snapshot = snapshot[snapshot['Extraction_Date'] == snapshot_date.isoformat()]
+    snapshot = snapshot.drop_duplicates(['Sigla da Cidade', 'Slug', 'Extraction_Date'], keep='last')
+
+    conn = get_index()
+    recorded = recorded_keys(conn, list(snapshot['Extraction_Date'].unique()))
+    keys = zip(snapshot['Sigla da Cidade'], snapshot['Slug'], snapshot['Extraction_Date'])
+    snapshot = snapshot[[key not in recorded for key in keys]]
+    if snapshot.empty:
+        conn.close()
+        print("Nenhum gráfico novo para registrar no histórico.")
+        return 0
+
+    with conn:
+        for (extraction_date, city_code), city_df in snapshot.groupby(['Extraction_Date', 'Sigla da Cidade']):
+            path = partition_file(extraction_date, city_code)
+            if os.path.exists(path):
+                # Gráficos baixados no mesmo dia por uma execução anterior continuam na partição
+                city_df = pd.concat([read_partition(path), city_df], ignore_index=True)
+                city_df = city_df.drop_duplicates(['Sigla da Cidade', 'Slug'], keep='last')
+            write_partition(city_df.reset_index(drop=True), path)
+            conn.executemany(
+                "INSERT OR REPLACE INTO snapshots (city, slug, date, path) VALUES (?, ?, ?, ?)",
+                [(city_code, slug, extraction_date, path) for slug in city_df['Slug']],
+            )
+    conn.close()
+    dates = ', '.join(sorted(snapshot['Extraction_Date'].unique()))
+    print(f"Histórico: {len(snapshot)} gráficos novos registrados ({dates})")
+    return len(snapshot)
+
+def read_history(slug, start=None, end=None):
+    # Série de um participante: o índice devolve só as partições (data, cidade) onde ele aparece
+    conn = get_index()
+    rows = conn.execute(
+        "SELECT date, path FROM snapshots WHERE slug = ? AND date >= ? AND date <= ? ORDER BY date",
+        (slug, str(start or '0000-00-00'), str(end or '9999-99-99')),
+    ).fetchall()
+    conn.close()
+    frames = [read_partition(path, slug).assign(Snapshot_Date=snapshot_date)
+              for snapshot_date, path in rows if os.path.exists(path)]
+    if not frames:
+        return pd.DataFrame(columns=SNAPSHOT_COLUMNS + ['Snapshot_Date'])
+    return pd.concat(frames, ignore_index=True)
+
+def read_range(start=None, end=None, city_code=None):
+    # Todos os participantes num intervalo, opcionalmente de uma única cidade
+    conn = get_index()
+    query = "SELECT DISTINCT date, path FROM snapshots WHERE date >= ? AND date <= ?"
+    params = [str(start or '0000-00-00'), str(end or '9999-99-99')]
+    if city_code:
+        query += " AND city = ?"
+        params.append(city_code)
+    rows = conn.execute(query + " ORDER BY date", params).fetchall()
+    conn.close()
+    frames = [read_partition(path).assign(Snapshot_Date=snapshot_date)
+              for snapshot_date, path in rows if os.path.exists(path)]
+    if not frames:
+        return pd.DataFrame(columns=SNAPSHOT_COLUMNS + ['Snapshot_Date'])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,103 @@
+import os
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+from bs4 import BeautifulSoup, Comment, NavigableString
+
+# Extração pontual das páginas do ix.br: cada função procura só o elemento de que precisa
+# (o <select> de cidades, o <map> de participantes ou um <img>) com o parser em C do selectolax (lexbor).
+# Sem selectolax, as mesmas consultas CSS rodam sobre o BeautifulSoup com html.parser.
+HTML_BACKEND = os.getenv("HTML_BACKEND", "auto")  # "auto", "selectolax" ou "bs4"
+
+def use_selectolax():
+    return HTML_BACKEND != "bs4" and HTMLParser is not None
+
+class Node:
+    # Interface mínima comum aos dois parsers; cada nó guarda o backend com que foi criado
+    def __init__(self, node, selectolax):
+        self.node = node
+        self.selectolax = selectolax
+
+    def attrs(self):
+        if self.selectolax:
+            return {k: v or '' for k, v in self.node.attributes.items()}
+        return {k: ' '.join(v) if isinstance(v, list) else v for k, v in self.node.attrs.items()}
+
+    def get(self, name, default=None):
+        return self.attrs().get(name, default)
+
+    @property
+    def tag(self):
+        # Nós de texto e comentários seguem a convenção do selectolax: '-text' e '-comment'
+        if self.selectolax:
+            return self.node.tag
+        if isinstance(self.node, Comment):
+            return '-comment'
+        if isinstance(self.node, NavigableString):
+            return '-text'
+        return self.node.name
+
+    def text(self):
+        if self.selectolax:
+            return self.node.text()
+        return str(self.node) if isinstance(self.node, NavigableString) else self.node.get_text()
+
+    def children(self):
+        # Filhos diretos na ordem do documento, incluindo os nós de texto
+        nodes = self.node.iter(include_text=True) if self.selectolax else self.node.children
+        return [Node(node, self.selectolax) for node in nodes]
+
+    def css(self, selector):
+        nodes = self.node.css(selector) if self.selectolax else self.node.select(selector)
+        return [Node(node, self.selectolax) for node in nodes]
+
+    def css_first(self, selector):
+        node = self.node.css_first(selector) if self.selectolax else self.node.select_one(selector)
+        return Node(node, self.selectolax) if node is not None else None
+
+def parse(html):
+    selectolax = use_selectolax()
+    return Node(HTMLParser(html) if selectolax else BeautifulSoup(html, 'html.parser'), selectolax)
+
+def select_options(html, selector='select'):
+    # [(value, texto)] das opções do primeiro <select> que casa com o seletor; None se não houver
+    select = parse(html).css_first(selector)
+    if select is None:
+        return None
+    return [(option.get('value') or '', option.text().strip()) for option in select.css('option')]
+
+def map_areas(html):
+    # Atributos das <area> do primeiro <map>; None quando a página não tem <map>
+    map_tag = parse(html).css_first('map')
+    if map_tag is None:
+        return None
+    return [area.attrs() for area in map_tag.css('area')]
+
+def img_src(html, selector):
+    img = parse(html).css_first(selector)
+    return img.get('src') if img is not None else None
+
+def img_srcs(html, alts):
+    # {alt: src} para vários períodos com um único parse da página
+    wanted = set(alts)
+    srcs = {}
+    for img in parse(html).css('img[alt]'):
+        attrs = img.attrs()
+        if attrs.get('alt') in wanted and attrs.get('src'):
+            srcs[attrs['alt']] = attrs['src']
+    return srcs
+
+def clean_html(html, tags=('script', 'style', 'noscript', 'nav', 'header', 'footer', 'form', 'svg', 'iframe')):
+    # HTML do <body> sem as tags que não carregam conteúdo (scripts, estilos, navegação)
+    if use_selectolax():
+        tree = HTMLParser(html)
+        tree.strip_tags(list(tags))
+        root = tree.body or tree.root
+        return root.html if root is not None else ''
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup.find_all(list(tags)):
+        tag.decompose()
+    return str(soup.body or soup)
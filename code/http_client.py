@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import http_replay
+
+# Configuração compartilhada por todos os módulos que acessam ix.br e PeeringDB
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))  # Conexões keep-alive mantidas por host
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "8"))
+HOST_REQUESTS_PER_SECOND = float(os.getenv("HTTP_HOST_REQUESTS_PER_SECOND", "10"))  # 0 desliga o limite
+MAX_RETRIES = 3
+RETRY_DELAY = 5  # seconds
+REQUEST_TIMEOUT = 10  # seconds
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_host_lock = threading.Lock()
+_host_semaphores = {}
+_host_paused_until = {}
+_host_next_slot = {}
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # pool_block evita abrir conexões extras quando o pool está cheio: as requisições
+            # esperam por uma conexão já estabelecida em vez de repetir o handshake TCP+TLS
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'User-Agent': USER_AGENT, 'Connection': 'keep-alive'})
+            _session = session
+    return _session
+
+def host_semaphore(host):
+    with _host_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST)
+        return _host_semaphores[host]
+
+def pause_host(host, seconds):
+    with _host_lock:
+        _host_paused_until[host] = max(_host_paused_until.get(host, 0.0), time.monotonic() + seconds)
+
+def wait_for_host(host):
+    with _host_lock:
+        wait_time = _host_paused_until.get(host, 0.0) - time.monotonic()
+    if wait_time > 0:
+        time.sleep(wait_time)
+
+def throttle_host(host, requests_per_second=HOST_REQUESTS_PER_SECOND):
+    # Espaça as requisições ao mesmo host entre todas as threads do processo; cada chamada reserva
+    # o próximo horário livre e dorme até ele fora do lock
+    if requests_per_second <= 0:
+        return
+    with _host_lock:
+        now = time.monotonic()
+        slot = max(now, _host_next_slot.get(host, now))
+        _host_next_slot[host] = slot + 1 / requests_per_second
+    if slot > now:
+        time.sleep(slot - now)
+
+def retry_after_seconds(response):
+    value = response.headers.get('Retry-After', '')
+    return int(value) if value.isdigit() else None
+
+def http_get(url, retries=MAX_RETRIES, retry_delay=RETRY_DELAY, timeout=REQUEST_TIMEOUT, **kwargs):
+    host = urlsplit(url).netloc
+    target = url
+    if http_replay.REPLAY_MODE != 'off':
+        # A chave da gravação é a URL original com os parâmetros; no replay ela vai para o servidor local,
+        # mas o semáforo, o limite de taxa e as pausas de 429 continuam por host original
+        url = http_replay.canonical_url(url, kwargs.pop('params', None))
+        target = http_replay.replay_target(url) if http_replay.replaying() else url
+    for attempt in range(retries):
+        wait_for_host(host)
+        throttle_host(host)
+        try:
+            with host_semaphore(host):
+                response = get_session().get(target, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries - 1:
+                raise
+            wait_time = retry_delay * (2 ** attempt)
+            print(f"Tentativa {attempt + 1} falhou para {url}. Erro: {e}. Tentando novamente em {wait_time} segundos...")
+            time.sleep(wait_time)
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < retries - 1:
+            wait_time = retry_after_seconds(response) or retry_delay * (2 ** attempt)
+            print(f"HTTP {response.status_code} em {url}. Aguardando {wait_time} segundos antes de tentar novamente...")
+            if response.status_code == 429:
+                # Pausa compartilhada: todas as threads que acessam o mesmo host aguardam
+                pause_host(host, wait_time)
+            else:
+                time.sleep(wait_time)
+            continue
+
+        response.raise_for_status()
+        if http_replay.recording() and response.status_code < 300:
+            http_replay.record_response(url, response)
+        return response
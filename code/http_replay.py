@@ -0,0 +1,219 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Gravação e reprodução offline das chamadas externas (ix.br, PeeringDB e OpenAI).
+# HTTP_REPLAY_MODE=record grava os corpos das respostas por hash do conteúdo (blobs/, um arquivo por
+# corpo distinto, mesmo que várias URLs o devolvam) e um índice requisição→hash do corpo (requests/);
+# HTTP_REPLAY_MODE=replay manda os GETs de http_client para o servidor local
+# (python http_replay.py serve), que devolve as respostas gravadas com latência e 429 injetados.
+# As chamadas ao modelo são reproduzidas no próprio processo, com as mesmas opções de injeção.
+REPLAY_MODE = os.getenv("HTTP_REPLAY_MODE", "off")  # "off", "record" ou "replay"
+FIXTURES_DIR = os.getenv("HTTP_FIXTURES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "http"))
+REPLAY_URL = os.getenv("HTTP_REPLAY_URL", "http://127.0.0.1:8765")
+LLM_REPLAY_LATENCY = float(os.getenv("LLM_REPLAY_LATENCY", "0"))  # seconds
+LLM_REPLAY_429_RATE = float(os.getenv("LLM_REPLAY_429_RATE", "0"))  # Fração das chamadas respondidas com 429
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+class FixtureMissing(RuntimeError):
+    pass
+
+class ReplayRateLimitError(RuntimeError):
+    # O nome contém "RateLimit" e status_code=429: extraction_scheduler trata como um 429 real
+    status_code = 429
+
+def recording():
+    return REPLAY_MODE == "record"
+
+def replaying():
+    return REPLAY_MODE == "replay"
+
+def canonical_url(url, params=None):
+    # Parâmetros da query em ordem estável, para que a mesma requisição sempre gere a mesma chave
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query += [(key, str(value)) for key, value in params.items()]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path or '/', urlencode(sorted(query)), ''))
+
+def request_key(kind, payload):
+    return hashlib.sha256(json.dumps([kind, payload], sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def fixture_path(key):
+    return os.path.join(FIXTURES_DIR, "requests", key[:2], f"{key}.json.gz")
+
+def blob_path(digest):
+    return os.path.join(FIXTURES_DIR, "blobs", digest[:2], f"{digest}.gz")
+
+def write_gzip(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Arquivo temporário por thread: várias threads podem gravar o mesmo arquivo ao mesmo tempo
+    tmp_path = f"{path}.{threading.get_ident()}.part"
+    with gzip.open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def store(key, entry):
+    # A gravação mais recente de uma requisição substitui a anterior
+    write_gzip(fixture_path(key), json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+
+def load(key):
+    path = fixture_path(key)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+def store_blob(content):
+    digest = hashlib.sha256(content).hexdigest()
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        write_gzip(path, content)
+    return digest
+
+def load_blob(digest):
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, 'rb') as f:
+        return f.read()
+
+def replay_target(url):
+    # https://ix.br/trafego/pix/sp → {REPLAY_URL}/https/ix.br/trafego/pix/sp
+    parts = urlsplit(url)
+    return f"{REPLAY_URL.rstrip('/')}/{parts.scheme}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+
+def record_response(url, response):
+    store(request_key('GET', url), {
+        'url': url,
+        'status': response.status_code,
+        'headers': {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+        'body_sha256': store_blob(response.content),
+        'recorded_at': time.time(),
+    })
+
+def replay_llm(payload, make_call):
+    # payload identifica a chamada (modelo, prompt, imagem); make_call() devolve o texto da resposta
+    key = request_key('LLM', payload)
+    if replaying():
+        if LLM_REPLAY_LATENCY:
+            time.sleep(LLM_REPLAY_LATENCY)
+        return replayed_llm_content(key)
+    content = make_call()
+    if recording():
+        store(key, {'model': payload.get('model'), 'content': content, 'recorded_at': time.time()})
+    return content
+
+async def areplay_llm(payload, make_call):
+    # Versão assíncrona: make_call() devolve uma corrotina com o texto da resposta
+    key = request_key('LLM', payload)
+    if replaying():
+        if LLM_REPLAY_LATENCY:
+            await asyncio.sleep(LLM_REPLAY_LATENCY)
+        return replayed_llm_content(key)
+    content = await make_call()
+    if recording():
+        store(key, {'model': payload.get('model'), 'content': content, 'recorded_at': time.time()})
+    return content
+
+def replayed_llm_content(key):
+    if LLM_REPLAY_429_RATE and random.random() < LLM_REPLAY_429_RATE:
+        raise ReplayRateLimitError("429 injetado pelo modo replay")
+    entry = load(key)
+    if entry is None:
+        raise FixtureMissing(f"Chamada ao modelo não gravada (chave {key})")
+    return entry['content']
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    jitter = 0.0
+    rate_429 = 0.0
+    retry_after = 1
+    rng = random.Random(0)
+    lock = threading.Lock()
+    counts = {'served': 0, 'missing': 0, 'throttled': 0}
+
+    def do_GET(self):
+        # O caminho carrega o esquema e o host originais: /https/ix.br/trafego/pix/sp?...
+        scheme, _, rest = self.path.lstrip('/').partition('/')
+        url = canonical_url(f"{scheme}://{rest}")
+        with self.lock:
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            throttle = self.rng.random() < self.rate_429
+        time.sleep(delay)
+
+        if throttle:
+            self.count('throttled')
+            self.send_response(429)
+            self.send_header('Retry-After', str(self.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        entry = load(request_key('GET', url))
+        body = load_blob(entry['body_sha256']) if entry is not None else None
+        if body is None:
+            self.count('missing')
+            body = f"Sem gravação para {url}".encode('utf-8')
+            self.send_response(404)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        else:
+            self.count('served')
+            self.send_response(entry['status'])
+            for name, value in entry['headers'].items():
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=8765, latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1, seed=0):
+    ReplayHandler.latency, ReplayHandler.jitter = latency, jitter
+    ReplayHandler.rate_429, ReplayHandler.retry_after = rate_429, retry_after
+    ReplayHandler.rng = random.Random(seed)
+    server = ThreadingHTTPServer(('127.0.0.1', port), ReplayHandler)
+    print(f"Servindo {FIXTURES_DIR} em http://127.0.0.1:{port} "
+          f"(latência {latency}s + até {jitter}s, 429 em {rate_429:.0%} das requisições)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Respostas: {ReplayHandler.counts}")
+
+def archive_files(subdir):
+    return [os.path.join(root, name) for root, _, names in os.walk(os.path.join(FIXTURES_DIR, subdir))
+            for name in names if not name.endswith('.part')]
+
+def archive_stats():
+    requests, blobs = archive_files("requests"), archive_files("blobs")
+    size = sum(os.path.getsize(path) for path in requests + blobs)
+    print(f"{len(requests)} requisições e {len(blobs)} corpos distintos em {FIXTURES_DIR} ({size / 1e6:.1f} MB comprimidos)")
+
+def option(name, default, cast=float):
+    if name in sys.argv:
+        return cast(sys.argv[sys.argv.index(name) + 1])
+    return default
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        serve(port=option('--port', 8765, int), latency=option('--latency', 0.0), jitter=option('--jitter', 0.0),
+              rate_429=option('--rate-429', 0.0), retry_after=option('--retry-after', 1, int), seed=option('--seed', 0, int))
+    else:
+        archive_stats()
+        print("Uso: python http_replay.py serve [--port 8765] [--latency s] [--jitter s] [--rate-429 fração] "
+              "[--retry-after s] [--seed n]")
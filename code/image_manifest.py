@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import time
+from datetime import date
+from urllib.parse import urljoin
+
+import requests
+
+from http_client import http_get
+
+MANIFEST_FILE = ".manifest.json"
+MANIFEST_TTL = 24 * 60 * 60  # seconds; após isso a URL da imagem é resolvida de novo pela página HTML
+REFRESH_EXISTING = False  # Revalida imagens existentes com GET condicional (ETag/Last-Modified)
+
+def manifest_path(output_path):
+    return os.path.join(output_path, MANIFEST_FILE)
+
+def load_manifest(output_path):
+    path = manifest_path(output_path)
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                print(f"Erro ao ler o manifesto {path}. Criando um novo.")
+    return {}
+
+def save_manifest(manifest, output_path):
+    path = manifest_path(output_path)
+    tmp_path = f"{path}.part"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def cached_image_url(manifest, img_filename, ttl=MANIFEST_TTL):
+    entry = manifest.get(img_filename)
+    if entry and time.time() - entry['resolved_at'] < ttl:
+        return entry['url']
+    return None
+
+def forget_image(manifest, img_filename):
+    manifest.pop(img_filename, None)
+
+def needs_download(img_path, refresh=REFRESH_EXISTING):
+    return refresh or not os.path.exists(img_path)
+
+def image_date(img_path):
+    # Data em que o conteúdo atual da imagem foi baixado: fetch_image só regrava o arquivo quando ele muda
+    return date.fromtimestamp(os.path.getmtime(img_path)).isoformat()
+
+def write_image(img_path, content):
+    # Grava em arquivo temporário para que um download interrompido não pareça completo
+    tmp_path = f"{img_path}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, img_path)
+
+def fetch_image(manifest, img_path, img_url, resolved_at=None, **kwargs):
+    img_filename = os.path.basename(img_path)
+    entry = manifest.get(img_filename, {})
+    headers = {}
+    if os.path.exists(img_path) and entry.get('url') == img_url:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    response = http_get(img_url, headers=headers, **kwargs)
+    digest = entry.get('sha256')
+    changed = response.status_code != 304
+    if changed:
+        # Servidores sem ETag/Last-Modified devolvem 200 sempre: o mesmo conteúdo não é regravado
+        digest = hashlib.sha256(response.content).hexdigest()
+        changed = digest != entry.get('sha256') or not os.path.exists(img_path)
+    if changed:
+        write_image(img_path, response.content)
+
+    manifest[img_filename] = {
+        'url': img_url,
+        'resolved_at': resolved_at or entry.get('resolved_at') or time.time(),
+        'etag': response.headers.get('ETag', entry.get('etag')),
+        'last_modified': response.headers.get('Last-Modified', entry.get('last_modified')),
+        'sha256': digest,
+    }
+    return changed
+
+def resolve_image_url(manifest, page_url, img_filename, find_img_src, **kwargs):
+    img_url = cached_image_url(manifest, img_filename)
+    if img_url:
+        return img_url, None
+    response = http_get(page_url, **kwargs)
+    img_src = find_img_src(response.text)
+    if not img_src:
+        return None, None
+    return urljoin(page_url, img_src), time.time()
+
+def download_image_file(manifest, page_url, img_path, find_img_src, **kwargs):
+    # Retorna None se a página não contém a imagem, True se o arquivo foi gravado e False se não mudou
+    img_filename = os.path.basename(img_path)
+    img_url, resolved_at = resolve_image_url(manifest, page_url, img_filename, find_img_src, **kwargs)
+    if not img_url:
+        return None
+    try:
+        return fetch_image(manifest, img_path, img_url, resolved_at, **kwargs)
+    except requests.HTTPError:
+        if resolved_at is not None:
+            raise
+        # URL do manifesto ficou obsoleta antes do TTL: resolve novamente pela página
+        forget_image(manifest, img_filename)
+        return download_image_file(manifest, page_url, img_path, find_img_src, **kwargs)
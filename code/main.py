@@ -1,6 +1,8 @@
 import os
 import subprocess
 
+from pipeline import run_pipeline
+
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
@@ -16,8 +18,9 @@ def run_module(module_number):
     input("Pressione Enter para continuar...")
 
 def run_all_modules():
-    for i in range(1, 6):
-        run_module(i)
+    # Pipeline com dependências declaradas: ramos independentes em paralelo, etapas inalteradas puladas
+    run_pipeline()
+    input("Pressione Enter para continuar...")
 
 def main_menu():
     while True:
@@ -28,7 +31,9 @@ def main_menu():
         print("3. IX-BR Slugs Extract Data")
         print("4. IX-BR Charts Images Download")
         print("5. IX-BR Charts Images Extract Data")
-        print("6. ALL - Executar todos os módulos")
+        print("6. IX-BR Topology Map Images Download")
+        print("7. IX-BR Topology Map Images Extract Data")
+        print("8. ALL - Executar o pipeline completo")
         print("0. EXIT - Sair")
         
         choice = input("Escolha uma opção: ")
@@ -36,9 +41,9 @@ def main_menu():
         if choice == '0':
             print("Saindo do programa...")
             break
-        elif choice in ['1', '2', '3', '4', '5']:
+        elif choice in ['1', '2', '3', '4', '5', '6', '7']:
             run_module(int(choice))
-        elif choice == '6':
+        elif choice == '8':
             run_all_modules()
         else:
             print("Opção inválida. Tente novamente.")
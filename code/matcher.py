@@ -0,0 +1,168 @@
+import hashlib
+import os
+import sqlite3
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from storage import OUTPUT_DIR
+
+try:
+    from rapidfuzz import fuzz, process
+    from rapidfuzz.process import cdist
+except ImportError:
+    from fuzzywuzzy import fuzz, process
+    cdist = None
+
+# Casamento aproximado entre nomes de empresas do ix.br e redes do PeeringDB (name e aka).
+# Cada nome só é comparado com os candidatos que compartilham tokens ou trigramas com ele
+# (índice invertido), e os resultados ficam num cache persistente chaveado pelo conjunto de candidatos.
+MATCH_THRESHOLD = 90  # Pontuação mínima (0-100) para aceitar um casamento
+MAX_CANDIDATES = 200  # Candidatos pontuados por nome, escolhidos pelo número de tokens/trigramas em comum
+MATCH_BATCH_SIZE = 16  # Nomes pontuados por chamada de cdist; limita a matriz a lote × união dos candidatos
+MATCH_WORKERS = os.cpu_count() or 1
+MAX_TOKEN_SHARE = 0.02  # Tokens presentes em mais que essa fração das redes ("telecom", "internet") não indexam
+MATCH_CACHE_FILE = os.path.join(OUTPUT_DIR, ".match_cache.sqlite")
+SCORER_NAME = "token_sort_ratio"
+
+LEGAL_SUFFIXES = r'\b(?:ltda|ltd|s\s?a|me|epp|eireli|inc|llc|cia|comercio|servicos|telecomunicacoes|telecom)\b'
+
+def normalize_name(names):
+    # Vetorizado sobre a coluna inteira: sem acentos, minúsculo, sem pontuação e sem sufixos societários
+    names = names.astype('string').str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('ascii')
+    names = names.str.lower().str.replace(r'[^a-z0-9 ]+', ' ', regex=True)
+    names = names.str.replace(LEGAL_SUFFIXES, ' ', regex=True)
+    return names.str.replace(r'\s+', ' ', regex=True).str.strip().fillna('')
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class CandidateIndex:
+    def __init__(self, keys, net_ids):
+        # Ordenado por net_id: empates de pontuação sempre resolvem para a mesma rede
+        order = np.lexsort((keys, net_ids))
+        self.keys = [keys[i] for i in order]
+        self.net_ids = np.asarray(net_ids)[order]
+        self.fingerprint = hashlib.sha256(
+            f"{SCORER_NAME}:{MATCH_THRESHOLD}\n".encode('utf-8')
+            + '\n'.join(f"{n}\t{k}" for n, k in zip(self.net_ids, self.keys)).encode('utf-8')
+        ).hexdigest()
+        self.tokens = self.build(lambda key: set(key.split()), max_share=MAX_TOKEN_SHARE)
+        self.trigrams = self.build(trigrams)
+
+    def build(self, features, max_share=None):
+        postings = defaultdict(list)
+        for i, key in enumerate(self.keys):
+            for feature in features(key):
+                postings[feature].append(i)
+        limit = max(1, int(len(self.keys) * max_share)) if max_share else None
+        return {feature: np.array(ids, dtype=np.int32) for feature, ids in postings.items()
+                if limit is None or len(ids) <= limit}
+
+    def candidates(self, key):
+        # Bloqueio por tokens; se nenhum token raro coincidir, cai para os trigramas
+        for index, features in ((self.tokens, set(key.split())), (self.trigrams, trigrams(key))):
+            hits = [index[f] for f in features if f in index]
+            if hits:
+                counts = np.bincount(np.concatenate(hits), minlength=len(self.keys))
+                ranked = np.flatnonzero(counts)
+                if len(ranked) > MAX_CANDIDATES:
+                    # Ordem estável: mais features em comum primeiro, depois a posição (net_id)
+                    ranked = ranked[np.argsort(-counts[ranked], kind='stable')[:MAX_CANDIDATES]]
+                return np.sort(ranked)
+        return np.array([], dtype=np.int64)
+
+    def best_match(self, key):
+        ids = self.candidates(key)
+        if not key or len(ids) == 0:
+            return None, 0.0
+        choices = [self.keys[i] for i in ids]
+        result = process.extractOne(key, choices, scorer=getattr(fuzz, SCORER_NAME), score_cutoff=MATCH_THRESHOLD)
+        if not result:
+            return None, 0.0
+        # rapidfuzz devolve (escolha, pontuação, posição); fuzzywuzzy, (escolha, pontuação)
+        position = result[2] if len(result) > 2 else choices.index(result[0])
+        return int(self.net_ids[ids[position]]), float(result[1])
+
+    def best_matches(self, keys, batch_size=MATCH_BATCH_SIZE):
+        # Pontua lotes de nomes numa única matriz com rapidfuzz cdist, em todos os núcleos; cada linha
+        # só considera os candidatos do próprio nome, e o restante da matriz é mascarado. Com as chaves
+        # em ordem alfabética, nomes vizinhos compartilham boa parte dos candidatos. A matriz pontua
+        # pares a mais, então com um único núcleo o extractOne por nome continua mais rápido.
+        if cdist is None or MATCH_WORKERS == 1:
+            return {key: self.best_match(key) for key in keys}
+        results = {}
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            candidate_sets = [self.candidates(key) if key else np.array([], dtype=np.int64) for key in batch]
+            union = np.unique(np.concatenate(candidate_sets)).astype(np.int64)
+            if len(union) == 0:
+                results.update({key: (None, 0.0) for key in batch})
+                continue
+            scores = cdist(batch, [self.keys[i] for i in union], scorer=getattr(fuzz, SCORER_NAME),
+                           dtype=np.float64, workers=MATCH_WORKERS, score_cutoff=MATCH_THRESHOLD)
+            mask = np.zeros(scores.shape, dtype=bool)
+            for row, ids in enumerate(candidate_sets):
+                mask[row, np.searchsorted(union, ids)] = True
+            scores = np.where(mask, scores, 0.0)
+            # argmax devolve a primeira coluna máxima: empates resolvem para o menor net_id, como no extractOne
+            best = scores.argmax(axis=1)
+            for row, key in enumerate(batch):
+                score = scores[row, best[row]]
+                if score >= MATCH_THRESHOLD:
+                    results[key] = (int(self.net_ids[union[best[row]]]), float(score))
+                else:
+                    results[key] = (None, 0.0)
+        return results
+
+def get_cache(cache_file=MATCH_CACHE_FILE):
+    os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+    conn = sqlite3.connect(cache_file)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS matches ("
+        "fingerprint TEXT NOT NULL, name_key TEXT NOT NULL, net_id INTEGER, score REAL NOT NULL, "
+        "PRIMARY KEY (fingerprint, name_key))"
+    )
+    return conn
+
+def network_keys(networks):
+    # Cada rede entra uma vez pelo name e uma vez por aka, todos apontando para o mesmo net_id
+    names = networks[['net_id', 'net_name']].rename(columns={'net_name': 'name'})
+    if 'aka' in networks.columns:
+        names = pd.concat([names, networks[['net_id', 'aka']].rename(columns={'aka': 'name'})], ignore_index=True)
+    names = names.assign(key=normalize_name(names['name']))
+    names = names[names['key'] != ''].drop_duplicates(['net_id', 'key'])
+    return names['key'].tolist(), names['net_id'].astype('int64').tolist()
+
+def match_names(names, networks):
+    # Retorna, alinhado com names, o net_id casado (ou NA) e a pontuação
+    keys = normalize_name(names)
+    index = CandidateIndex(*network_keys(networks))
+    conn = get_cache()
+    unique_keys = sorted(set(keys) - {''})
+    cached = {}
+    for start in range(0, len(unique_keys), 500):
+        batch = unique_keys[start:start + 500]
+        rows = conn.execute(
+            f"SELECT name_key, net_id, score FROM matches WHERE fingerprint = ? AND name_key IN ({','.join('?' * len(batch))})",
+            [index.fingerprint, *batch],
+        ).fetchall()
+        cached.update({key: (net_id, score) for key, net_id, score in rows})
+
+    new_matches = index.best_matches([key for key in unique_keys if key not in cached])
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO matches (fingerprint, name_key, net_id, score) VALUES (?, ?, ?, ?)",
+            [(index.fingerprint, key, net_id, score) for key, (net_id, score) in new_matches.items()],
+        )
+    conn.close()
+    cached.update(new_matches)
+    print(f"Nomes casados: {len(unique_keys)} ({len(new_matches)} novos, {len(unique_keys) - len(new_matches)} do cache)")
+
+    results = [cached.get(key, (None, 0.0)) for key in keys]
+    return pd.DataFrame({
+        'net_id': pd.array([net_id for net_id, _ in results], dtype='Int64'),
+        'match_score': [score for _, score in results],
+    }, index=names.index)
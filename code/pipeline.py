@@ -0,0 +1,194 @@
+import ast
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Executor não interativo do pipeline. Cada etapa declara dependências, entradas e saídas;
+# etapas independentes rodam em paralelo, e etapas locais cujas entradas (o próprio script, os
+# módulos locais que ele importa e os dados desses módulos) não mudaram desde a última execução
+# bem-sucedida são puladas.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(BASE_DIR, "output", ".pipeline_state.json")
+LOG_DIR = os.path.join(BASE_DIR, "output", "logs")
+MAX_PARALLEL_STAGES = 4
+# Arquivos de dados lidos pelos módulos locais; entram na impressão digital de toda etapa que os importa
+MODULE_DATA = {
+    'chart_reader.py': ['glyphs/*.npz'],
+}
+
+# 'source': etapas que buscam dados na rede sempre rodam (elas próprias são incrementais)
+STAGES = {
+    'peeringdb': {'script': '1_peeringdb_extract_data.py', 'deps': [], 'source': True,
+                  'inputs': [], 'outputs': ['output/peeringdb_unified_data.*']},
+    'entities': {'script': '2_ix-br_entities_extract_data.py', 'deps': [], 'source': True,
+                 'inputs': [], 'outputs': ['output/ix-br_entities_data.*']},
+    'slugs': {'script': '3_ix-br_slugs_extract_data.py', 'deps': [], 'source': True,
+              'inputs': [], 'outputs': ['output/ix-br_slugs_data.*']},
+    'charts': {'script': '4_ix-br_charts_images_download.py', 'args': ['--all'], 'deps': ['slugs'], 'source': True,
+               'inputs': ['output/ix-br_slugs_data.*'], 'outputs': ['output/img/charts/*.png']},
+    'chart_extraction': {'script': '5_ix-br_charts_images_extract_data_.py', 'deps': ['charts'],
+                         'inputs': ['output/ix-br_slugs_data.*', 'output/img/charts/*__daily.png'],
+                         'outputs': ['output/ix-br_slugs_data_processed.*']},
+    'topology': {'script': '6_ix-br_topologymap_images_download.py', 'deps': ['slugs'], 'source': True,
+                 'inputs': ['output/ix-br_slugs_data.*'], 'outputs': ['output/img/topologymap/*.png']},
+    'topology_extraction': {'script': '7_ix-br_topologymap_images_extract_data.py', 'deps': ['topology'],
+                            'inputs': ['output/ix-br_slugs_data.*', 'output/img/topologymap/*.png'],
+                            'outputs': ['output/ix-br_topologymaps_data.*']},
+    'convert': {'script': 'convert_to_mbps.py', 'deps': ['chart_extraction', 'topology_extraction'],
+                'inputs': ['output/ix-br_slugs_data_processed.*', 'output/ix-br_topologymaps_data.*'],
+                'outputs': ['output/ix-br_slugs_data_converted.*']},
+    # Glifos do leitor local aprendidos das extrações do modelo; mudam a impressão digital do script 5
+    'glyphs': {'script': 'chart_reader.py', 'args': ['--learn', 'ix-br_slugs_data_processed', 'output/img/charts'],
+               'deps': ['chart_extraction'], 'inputs': ['output/ix-br_slugs_data_processed.*'],
+               'outputs': ['glyphs/chart_glyphs.npz']},
+    'curves': {'script': 'curve_digitizer.py', 'deps': ['charts', 'glyphs'],
+               'inputs': ['output/ix-br_slugs_data.*', 'output/img/charts/*__daily.png'],
+               'outputs': ['output/series/daily/*.npz']},
+    'analytics': {'script': 'analytics.py', 'deps': ['peeringdb', 'chart_extraction'],
+                  'inputs': ['output/peeringdb_*', 'output/ix-br_slugs_data_processed.*'],
+                  'outputs': ['output/utilisation_ports.*']},
+}
+
+def expand(patterns):
+    paths = set()
+    for pattern in patterns:
+        paths.update(glob.glob(os.path.join(BASE_DIR, pattern)))
+    return sorted(paths)
+
+def local_modules(script):
+    # O script e todos os módulos locais importados por ele, direta ou indiretamente
+    seen = set()
+    pending = [script]
+    while pending:
+        filename = pending.pop()
+        if filename in seen:
+            continue
+        seen.add(filename)
+        with open(os.path.join(BASE_DIR, filename), 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                path = f"{module.split('.')[0]}.py"
+                if os.path.exists(os.path.join(BASE_DIR, path)):
+                    pending.append(path)
+    return sorted(seen)
+
+def fingerprint(stage):
+    # Conteúdo do script, dos módulos locais e seus dados e de todos os arquivos de entrada, em ordem estável
+    modules = local_modules(STAGES[stage]['script'])
+    data = expand(pattern for module in modules for pattern in MODULE_DATA.get(module, []))
+    digest = hashlib.sha256()
+    for path in [os.path.join(BASE_DIR, module) for module in modules] + data + expand(STAGES[stage]['inputs']):
+        digest.update(os.path.relpath(path, BASE_DIR).encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def load_state():
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp_path = f"{STATE_FILE}.part"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_FILE)
+
+def with_dependencies(targets):
+    selected = set()
+    pending = list(targets)
+    while pending:
+        stage = pending.pop()
+        if stage not in selected:
+            selected.add(stage)
+            pending.extend(STAGES[stage]['deps'])
+    return selected
+
+def is_up_to_date(stage, state):
+    spec = STAGES[stage]
+    return not spec.get('source') and expand(spec['outputs']) and state.get(stage) == fingerprint(stage)
+
+def run_stage(stage):
+    spec = STAGES[stage]
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_path = os.path.join(LOG_DIR, f"{stage}.log")
+    started = time.monotonic()
+    # A saída de cada etapa vai para o seu log, sem intercalar com as etapas paralelas
+    with open(log_path, 'w', encoding='utf-8') as log:
+        result = subprocess.run([sys.executable, spec['script'], *spec.get('args', [])],
+                                cwd=BASE_DIR, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode, time.monotonic() - started, log_path
+
+def run_pipeline(targets=None, force=False, max_parallel=MAX_PARALLEL_STAGES):
+    selected = with_dependencies(targets or STAGES)
+    state = load_state()
+    status = {}
+    timings = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        while len(status) < len(selected):
+            for stage in sorted(selected - set(status) - set(running.values())):
+                deps = STAGES[stage]['deps']
+                if any(status.get(dep) in ('failed', 'blocked') for dep in deps if dep in selected):
+                    status[stage] = 'blocked'
+                elif all(status.get(dep) in ('ok', 'skipped') for dep in deps if dep in selected):
+                    if not force and is_up_to_date(stage, state):
+                        status[stage] = 'skipped'
+                        print(f"[{stage}] entradas inalteradas, pulando")
+                    else:
+                        print(f"[{stage}] iniciando {STAGES[stage]['script']}")
+                        running[executor.submit(run_stage, stage)] = stage
+            if not running:
+                # Nada em execução: ou tudo foi resolvido nesta passada, ou há um ciclo nas dependências
+                if len(status) < len(selected) and not any(
+                        all(dep in status for dep in STAGES[stage]['deps']) for stage in selected - set(status)):
+                    raise RuntimeError("Dependências cíclicas entre as etapas do pipeline")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                returncode, elapsed, log_path = future.result()
+                timings[stage] = elapsed
+                if returncode == 0:
+                    status[stage] = 'ok'
+                    state[stage] = fingerprint(stage)
+                    save_state(state)
+                    print(f"[{stage}] concluída em {elapsed:.1f}s")
+                else:
+                    status[stage] = 'failed'
+                    print(f"[{stage}] falhou (código {returncode}) após {elapsed:.1f}s; veja {log_path}")
+
+    print("\n=== Resumo do pipeline ===")
+    for stage in STAGES:
+        if stage in status:
+            elapsed = f"{timings[stage]:.1f}s" if stage in timings else "-"
+            print(f"{stage:22} {status[stage]:8} {elapsed:>8}")
+    return all(value in ('ok', 'skipped') for value in status.values())
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if '--list' in sys.argv:
+        for name, spec in STAGES.items():
+            print(f"{name:22} {spec['script']:45} depende de: {', '.join(spec['deps']) or '-'}")
+        sys.exit(0)
+    unknown = [arg for arg in args if arg not in STAGES]
+    if unknown:
+        print(f"Etapas desconhecidas: {', '.join(unknown)}. Use --list para ver as etapas.")
+        sys.exit(2)
+    sys.exit(0 if run_pipeline(args or None, force='--force' in sys.argv) else 1)
@@ -0,0 +1,109 @@
+import glob
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+
+from history import HISTORY_DIR
+from storage import OUTPUT_DIR, read_table, table_path
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Consultas SQL ad hoc sobre todas as tabelas de output/. Com DuckDB, cada tabela vira uma view
+# sobre o arquivo Parquet/CSV (nada é carregado em memória); sem ele, as tabelas são copiadas para
+# um SQLite indexado que só é reconstruído quando o arquivo de origem muda.
+QUERY_ENGINE = os.getenv("QUERY_ENGINE", "duckdb")  # "duckdb" ou "sqlite"
+SQLITE_FILE = os.path.join(OUTPUT_DIR, ".analytics.sqlite")
+INDEX_COLUMNS = ['asn', 'net_asn', 'net_id', 'ix_id', 'Slug', 'Sigla da Cidade']
+
+EXAMPLE_QUERIES = {
+    'capacity_per_ix': (
+        "SELECT ix_name, COUNT(DISTINCT net_id) AS networks, SUM(speed) AS total_speed_mbps "
+        "FROM peeringdb_unified_data GROUP BY ix_name ORDER BY total_speed_mbps DESC"
+    ),
+    # Velocidade das portas no PeeringDB e pico dos gráficos do ix.br, em Mbps (tabela do analytics.py)
+    'capacity_per_uf': (
+        "SELECT \"UF do Estado\", SUM(port_mbps) AS total_port_mbps, SUM(peak_mbps) AS total_peak_mbps, "
+        "COUNT(*) AS participants, COUNT(DISTINCT \"Sigla da Cidade\") AS cities "
+        "FROM utilisation_ports GROUP BY \"UF do Estado\" ORDER BY total_port_mbps DESC NULLS LAST"
+    ),
+    # Parâmetros: os dois ix_id comparados
+    'networks_at_both': (
+        "SELECT net_asn, net_name FROM peeringdb_unified_data WHERE ix_id IN (?, ?) "
+        "GROUP BY net_asn, net_name HAVING COUNT(DISTINCT ix_id) = 2 ORDER BY net_asn"
+    ),
+}
+
+def view_name(table):
+    return table.replace('-', '_')
+
+def discover_tables():
+    # Uma entrada por tabela, independentemente de existir em Parquet, CSV ou ambos
+    tables = set()
+    for path in glob.glob(os.path.join(OUTPUT_DIR, '*.parquet')) + glob.glob(os.path.join(OUTPUT_DIR, '*.csv')):
+        tables.add(os.path.splitext(os.path.basename(path))[0])
+    return sorted(tables)
+
+def source_path(table):
+    parquet_path = table_path(table, 'parquet')
+    return parquet_path if os.path.exists(parquet_path) else table_path(table, 'csv')
+
+def use_duckdb():
+    return QUERY_ENGINE == 'duckdb' and duckdb is not None
+
+def connect_duckdb():
+    conn = duckdb.connect()
+    for table in discover_tables():
+        path = source_path(table).replace("'", "''")
+        reader = 'read_parquet' if path.endswith('.parquet') else 'read_csv_auto'
+        conn.execute(f"CREATE VIEW \"{view_name(table)}\" AS SELECT * FROM {reader}('{path}')")
+    # Histórico particionado: filtros em date/city descartam partições sem lê-las
+    history_glob = os.path.join(HISTORY_DIR, '*', '*', 'part.parquet')
+    if glob.glob(history_glob):
+        conn.execute(f"CREATE VIEW chart_history AS SELECT * FROM read_parquet('{history_glob}', hive_partitioning = true)")
+    return conn
+
+def connect_sqlite(sqlite_file=SQLITE_FILE):
+    conn = sqlite3.connect(sqlite_file)
+    conn.execute("CREATE TABLE IF NOT EXISTS _sources (name TEXT PRIMARY KEY, mtime REAL NOT NULL)")
+    loaded = dict(conn.execute("SELECT name, mtime FROM _sources").fetchall())
+    for table in discover_tables():
+        name = view_name(table)
+        mtime = os.path.getmtime(source_path(table))
+        if loaded.get(name) == mtime:
+            continue
+        print(f"Carregando {table} no SQLite...")
+        df = read_table(table)
+        df.to_sql(name, conn, if_exists='replace', index=False, chunksize=10000)
+        for col in INDEX_COLUMNS:
+            if col in df.columns:
+                index = f"{name}_{col}".replace(' ', '_').lower()
+                conn.execute(f"CREATE INDEX IF NOT EXISTS \"{index}\" ON \"{name}\" (\"{col}\")")
+        conn.execute("INSERT OR REPLACE INTO _sources (name, mtime) VALUES (?, ?)", (name, mtime))
+        conn.commit()
+    return conn
+
+def connect():
+    return connect_duckdb() if use_duckdb() else connect_sqlite()
+
+def query(sql, params=None, conn=None):
+    conn = conn or connect()
+    if use_duckdb():
+        return conn.execute(sql, params or []).df()
+    return pd.read_sql_query(sql, conn, params=params or [])
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        print("Tabelas disponíveis:")
+        for table in discover_tables():
+            print(f"  {view_name(table)}")
+        print(f"Exemplos: {', '.join(EXAMPLE_QUERIES)}")
+        print("Uso: python query.py \"<sql>\" [parâmetros...] | python query.py --example <nome> [parâmetros...]")
+    elif sys.argv[1] == '--example':
+        print(query(EXAMPLE_QUERIES[sys.argv[2]], sys.argv[3:]).to_string(index=False))
+    else:
+        print(query(sys.argv[1], sys.argv[2:]).to_string(index=False))
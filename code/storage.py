@@ -0,0 +1,106 @@
+import json
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Camada de armazenamento das tabelas em output/: Parquet com esquema explícito é o formato
+# principal; o CSV é gravado ao lado apenas como exportação para leitura humana e planilhas.
+OUTPUT_DIR = "output"
+STORAGE_FORMAT = os.getenv("STORAGE_FORMAT", "parquet")  # "parquet" ou "csv"
+EXPORT_CSV = os.getenv("EXPORT_CSV", "1") != "0"
+
+ID = "Int64"  # Inteiro com suporte a nulos: ids, ASNs e velocidades não viram float quando há NaN
+TEXT = "string"
+
+SCHEMAS = {
+    "peeringdb_ix_data": {"id": ID, "org_id": ID, "name": TEXT, "city": TEXT, "country": TEXT},
+    "peeringdb_ixlan_data": {"id": ID, "ix_id": ID, "name": TEXT},
+    "peeringdb_netixlan_data": {"id": ID, "net_id": ID, "ix_id": ID, "ixlan_id": ID, "asn": ID,
+                                "ipaddr4": TEXT, "ipaddr6": TEXT, "speed": ID},
+    "peeringdb_fac_data": {"id": ID, "org_id": ID, "name": TEXT, "city": TEXT, "country": TEXT},
+    "peeringdb_ixfac_data": {"id": ID, "ix_id": ID, "fac_id": ID},
+    "peeringdb_net_data": {"id": ID, "asn": ID, "name": TEXT, "info_type": TEXT, "policy_general": TEXT},
+    "peeringdb_poc_data": {"id": ID, "net_id": ID},
+    "peeringdb_dim_ix": {"ix_id": ID, "ix_org_id": ID, "fac_count": ID, "fac_ids": TEXT, "fac_names": TEXT},
+    "peeringdb_dim_net": {"net_id": ID, "net_asn": ID},
+    "peeringdb_dim_fac": {"fac_id": ID, "fac_org_id": ID},
+    "peeringdb_bridge_ixfac": {"ixfac_id": ID, "ix_id": ID, "fac_id": ID},
+    "peeringdb_fact_netixlan": {"netixlan_id": ID, "net_id": ID, "ix_id": ID, "ixlan_id": ID, "asn": ID, "speed": ID},
+    "peeringdb_unified_data": {"ix_id": ID, "ixlan_id": ID, "netixlan_id": ID, "net_id": ID, "ix_org_id": ID,
+                               "net_asn": ID, "speed": ID, "fac_count": ID, "fac_ids": TEXT, "fac_names": TEXT},
+    "ix-br_entities_data": {col: TEXT for col in [
+        "Sigla da Cidade", "Nome da Cidade", "UF do Estado", "Nome curto Empresa", "Nome longo Empresa",
+        "Nome do Responsável", "E-mail", "Domínio"]},
+    "ix-br_slugs_data": {col: TEXT for col in [
+        "Sigla da Cidade", "Nome da Cidade", "UF do Estado", "Nome curto Empresa", "Slug",
+        "Nome longo Empresa", "Coordenadas"]},
+}
+# As tabelas das etapas de extração herdam o esquema da tabela de slugs; as colunas extraídas são texto
+SCHEMAS["ix-br_slugs_data_processed"] = dict(SCHEMAS["ix-br_slugs_data"])
+SCHEMAS["ix-br_topologymaps_data"] = dict(SCHEMAS["ix-br_slugs_data"])
+
+def use_parquet():
+    return STORAGE_FORMAT == "parquet" and pq is not None
+
+def table_path(name, fmt=None):
+    fmt = fmt or ("parquet" if use_parquet() else "csv")
+    return os.path.join(OUTPUT_DIR, f"{name}.{fmt}")
+
+def table_exists(name):
+    return any(os.path.exists(table_path(name, fmt)) for fmt in ("parquet", "csv"))
+
+def nested_to_json(series):
+    # Campos aninhados da API (listas e dicts) são gravados como JSON, como o CSV já fazia implicitamente
+    if series.dtype == object and series.map(lambda v: isinstance(v, (list, dict))).any():
+        return series.map(lambda v: json.dumps(v) if isinstance(v, (list, dict)) else v)
+    return series
+
+def apply_schema(df, name):
+    schema = SCHEMAS.get(name, {})
+    df = df.apply(nested_to_json)
+    for col, dtype in schema.items():
+        if col in df.columns:
+            if dtype == ID:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype(ID)
+            else:
+                df[col] = df[col].astype(dtype)
+    return df
+
+def replace_file(path, write):
+    tmp_path = f"{path}.part"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def write_table(data, name, export_csv=EXPORT_CSV):
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    df = apply_schema(df, name)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if use_parquet():
+        replace_file(table_path(name, "parquet"), lambda path: df.to_parquet(path, engine='pyarrow', index=False))
+    if export_csv or not use_parquet():
+        write_csv_export(df, name)
+    return df
+
+def invalidate_parquet(name):
+    # Para tabelas regravadas como CSV incremental: sem o Parquet anterior, uma execução interrompida
+    # deixa o CSV parcial mais recente como a versão lida por read_table, e não uma cópia antiga
+    path = table_path(name, "parquet")
+    if os.path.exists(path):
+        os.remove(path)
+
+def write_csv_export(df, name, **to_csv_kwargs):
+    # Formatação regional (ex.: decimal=',') só na exportação; a tabela principal guarda floats
+    replace_file(table_path(name, "csv"), lambda path: df.to_csv(path, index=False, **to_csv_kwargs))
+
+def read_table(name, columns=None):
+    # Lê só as colunas pedidas; o Parquet é mapeado em memória em vez de passar pelo parser de texto
+    parquet_path = table_path(name, "parquet")
+    if pq is not None and os.path.exists(parquet_path):
+        return pq.read_table(parquet_path, columns=columns, memory_map=True).to_pandas()
+    df = pd.read_csv(table_path(name, "csv"), usecols=columns)
+    return apply_schema(df, name)
@@ -0,0 +1,163 @@
+import asyncio
+import csv
+import importlib.util
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from extraction_results import ResultLog, apply_results, compact, replay_log, result_log_path
+from image_manifest import load_manifest, save_manifest
+from storage import invalidate_parquet, read_table, table_exists, write_table
+
+# Modo streaming dos scripts 3 → 4 → 5: cada cidade descoberta vai direto para uma fila limitada,
+# de onde os downloaders de gráficos e os extratores consomem. O primeiro resultado sai após a
+# latência de uma cidade, e rede e parsing se sobrepõem em vez de esperar o CSV completo.
+QUEUE_SIZE = 64  # Slugs aguardando download/extração; limita a memória e dá contrapressão ao produtor
+DOWNLOAD_WORKERS = 16
+EXTRACTION_WORKERS = 16
+REQUESTS_PER_SECOND_PER_HOST = 10  # Substitui o time.sleep(1) fixo entre cidades do script 3
+CITY_PAGE_URL = 'https://ix.br/trafego/pix/'
+SLUGS_CSV = os.path.join('output', 'ix-br_slugs_data.csv')
+CHARTS_DIR = os.path.join('output', 'img', 'charts')
+PROCESSED_TABLE = 'ix-br_slugs_data_processed'
+
+def load_script(filename):
+    # Os scripts numerados não são importáveis pelo nome; carregados assim, o bloco __main__ não roda
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(f"script_{filename[0]}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+async def produce_slugs(slugs_script, city_info, slug_queue, writer, csvfile, rows, rate_limiter):
+    seen = set()
+    for city_code, city_uf in city_info:
+        url = f'{CITY_PAGE_URL}{city_code}'
+        await rate_limiter.wait(url)
+        try:
+            html_content = await asyncio.to_thread(slugs_script.get_company_data, url)
+        except Exception as e:
+            print(f"Falha ao acessar {url}. Erro: {e}")
+            continue
+        city_rows = slugs_script.company_rows(city_code, city_uf, slugs_script.extract_map_data(html_content))
+        writer.writerows(city_rows)
+        csvfile.flush()
+        rows.extend(city_rows)
+        for row in city_rows:
+            key = (city_code, row[4])
+            if row[4] and key not in seen:
+                seen.add(key)
+                # Bloqueia quando os consumidores estão atrasados
+                await slug_queue.put(key)
+        print(f"{city_code}: {len(city_rows)} participantes enfileirados")
+
+async def download_worker(charts_script, slug_queue, extract_queue, graph_types, semaphore, rate_limiter, manifest):
+    while True:
+        item = await slug_queue.get()
+        if item is None:
+            break
+        city_code, slug = item
+        url = f'{CITY_PAGE_URL}{city_code}/{slug}/bps'
+        try:
+            await charts_script.download_slug_charts_async(url, CHARTS_DIR, city_code, slug, graph_types,
+                                                           semaphore, rate_limiter, manifest)
+        except Exception as e:
+            print(f"Falha ao baixar gráficos de {slug}. Erro: {e}")
+            continue
+        daily_path = os.path.join(CHARTS_DIR, charts_script.chart_filename(city_code, slug, 'Daily'))
+        if extract_queue is not None and os.path.exists(daily_path):
+            await extract_queue.put(item)
+
+async def extraction_worker(extract_script, extract_queue, scheduler, results, result_log):
+    while True:
+        item = await extract_queue.get()
+        if item is None:
+            break
+        city_code, slug = item
+        # A chave (cidade, slug) faz o papel do índice da linha que process_single_image devolve
+        try:
+            _, extracted_data, status = await extract_script.process_single_image(item, slug, city_code, CHARTS_DIR, scheduler)
+        except Exception as e:
+            extracted_data, status = None, f"error: {e}"
+        if status not in ("success", "cached"):
+            print(f"Falha na extração de {slug}: {status}")
+            continue
+        try:
+            image_path = extract_script.chart_path(CHARTS_DIR, city_code, slug)
+            results[item] = extract_script.parse_extraction(extracted_data, extract_script.image_date(image_path))
+        except IndexError:
+            print(f"Formato inesperado na extração de {slug}: {extracted_data!r}")
+            continue
+        result_log.append(item, results[item])
+
+def previous_results(slugs_df, columns):
+    # Parte dos valores já extraídos: participantes novos entram vazios, os demais mantêm o valor anterior
+    df = slugs_df.copy()
+    if table_exists(PROCESSED_TABLE):
+        keys = ['Sigla da Cidade', 'Slug']
+        previous = read_table(PROCESSED_TABLE)
+        previous = previous[keys + [col for col in columns if col in previous.columns]]
+        df = df.merge(previous.drop_duplicates(keys, keep='last'), on=keys, how='left')
+    for col in columns:
+        if col not in df.columns:
+            df[col] = pd.NA
+    return df
+
+async def run_stream(extract=True, graph_types=('Daily',)):
+    slugs_script = load_script('3_ix-br_slugs_extract_data.py')
+    charts_script = load_script('4_ix-br_charts_images_download.py')
+    extract_script = load_script('5_ix-br_charts_images_extract_data_.py') if extract else None
+
+    os.makedirs(CHARTS_DIR, exist_ok=True)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS + EXTRACTION_WORKERS + 1))
+    city_info = await asyncio.to_thread(slugs_script.get_city_info, CITY_PAGE_URL)
+    rate_limiter = charts_script.HostRateLimiter(REQUESTS_PER_SECOND_PER_HOST)
+    semaphore = asyncio.Semaphore(DOWNLOAD_WORKERS)
+    manifest = load_manifest(CHARTS_DIR)
+    slug_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    extract_queue = asyncio.Queue(maxsize=QUEUE_SIZE) if extract else None
+    rows = []
+    results = {}
+    log_path = result_log_path(PROCESSED_TABLE)
+    # Resultados de uma execução interrompida que ainda não foram compactados na tabela
+    replayed = replay_log(log_path) if extract else {}
+    invalidate_parquet('ix-br_slugs_data')
+
+    with open(SLUGS_CSV, 'w', newline='', encoding='utf-8') as csvfile, ResultLog(log_path) as result_log:
+        writer = csv.writer(csvfile)
+        writer.writerow(slugs_script.COLUMNS)
+        downloaders = [asyncio.create_task(download_worker(charts_script, slug_queue, extract_queue, list(graph_types),
+                                                           semaphore, rate_limiter, manifest))
+                       for _ in range(DOWNLOAD_WORKERS)]
+        extractors = []
+        if extract:
+            scheduler = extract_script.ExtractionScheduler()
+            extractors = [asyncio.create_task(extraction_worker(extract_script, extract_queue, scheduler, results, result_log))
+                          for _ in range(EXTRACTION_WORKERS)]
+
+        await produce_slugs(slugs_script, city_info, slug_queue, writer, csvfile, rows, rate_limiter)
+        # Um marcador de fim por consumidor; cada estágio só encerra o seguinte depois de drenar
+        for _ in downloaders:
+            await slug_queue.put(None)
+        await asyncio.gather(*downloaders)
+        for _ in extractors:
+            await extract_queue.put(None)
+        await asyncio.gather(*extractors)
+
+    save_manifest(manifest, CHARTS_DIR)
+    slugs_df = write_table(pd.DataFrame(rows, columns=slugs_script.COLUMNS), 'ix-br_slugs_data', export_csv=False)
+    print(f"Slugs salvos: {len(rows)} linhas em {SLUGS_CSV}")
+    if extract:
+        df = previous_results(slugs_df, extract_script.EXTRACTION_COLUMNS)
+        df = apply_results(df, {**replayed, **results}, extract_script.RESULT_KEY)
+        compact(df, PROCESSED_TABLE, log_path)
+        extract_script.append_snapshot(df)
+        print(f"Extrações concluídas: {len(results)} gráficos")
+
+if __name__ == "__main__":
+    # '--all' baixa todos os períodos; a extração usa apenas o gráfico diário
+    graph_types = load_script('4_ix-br_charts_images_download.py').GRAPH_TYPES if '--all' in sys.argv else ['Daily']
+    asyncio.run(run_stream(extract='--no-extract' not in sys.argv, graph_types=graph_types))